@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: benchmark-tools.py [--scales 1000,10000] [--tools TOOL,...] [-o results.json] [--baseline baseline.json]
+# Generates synthetic inputs with generate-export.py at each scale (number of messages), runs each tool on them in a
+# separate process, and reports its wall time, peak memory use (RSS) and throughput, optionally comparing them with a
+# previous run's results.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Each tool's input format (as generated by generate-export.py), and its command line, given its input file and a
+# directory for its output
+TOOLS = {
+    'generate-export': ('zip', lambda input_file, output_directory, options: [
+        'generate-export.py', *options, '-o', os.path.join(output_directory, 'generated.zip')]),
+    'redact-messages': ('zip', lambda input_file, output_directory, options: [
+        'redact-messages.py', '-a', 'keep', '-o', os.path.join(output_directory, 'redacted.zip'), input_file]),
+    'messages_browser': ('zip', lambda input_file, output_directory, options: [
+        'contrib/messages_browser.py', '--no-index', '--benchmark', '1', input_file]),
+    'merge-exports': ('zip', lambda input_file, output_directory, options: [
+        'merge-exports.py', '-o', os.path.join(output_directory, 'merged.zip'), input_file, input_file]),
+    'delta-export': ('zip', lambda input_file, output_directory, options: [
+        'delta-export.py', 'create', '-o', os.path.join(output_directory, 'delta.zip'), input_file, input_file]),
+    'exports-to-sqlite': ('zip', lambda input_file, output_directory, options: [
+        'exports-to-sqlite.py', '-d', os.path.join(output_directory, 'exports.db'), input_file]),
+    'verify-export': ('zip', lambda input_file, output_directory, options: ['verify-export.py', input_file]),
+    'split-export': ('zip', lambda input_file, output_directory, options: [
+        'split-export.py', '-b', 'date', '-p', 'year', '-d', os.path.join(output_directory, 'shards'), input_file]),
+    'v1-v2-convert': ('v1', lambda input_file, output_directory, options: ['v1-v2-convert.py', input_file]),
+    'silence-convert': ('silence', lambda input_file, output_directory, options: ['silence-convert.py', input_file]),
+    'csv-convert': ('csv', lambda input_file, output_directory, options: [
+        'csv-convert.py', '-o', os.path.join(output_directory, 'csv.zip'), input_file]),
+}
+NOISE_SECONDS = 0.05  # smaller differences in time aren't reported as regressions
+INPUT_NAMES = {'zip': 'messages-{}.zip', 'v1': 'v1-{}.json', 'silence': 'silence-{}.xml', 'csv': 'csv-{}.csv'}
+
+
+def run(command):
+    """Run a tool with its output discarded, returning (seconds, peak RSS in bytes, or None if unknown)."""
+    with tempfile.TemporaryFile() as errors:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, *command], cwd=TOOLS_DIRECTORY, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=errors)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        else:
+            process.wait()
+            peak_rss = None
+        seconds = time.perf_counter() - start
+        if process.returncode:
+            errors.seek(0)
+            raise RuntimeError(f'{" ".join(command)} failed:\n{errors.read().decode(errors="replace")}')
+    return seconds, peak_rss
+
+
+def generate(input_format, scale, work_directory, options):
+    """Generate (or reuse) the input in input_format with scale messages."""
+    input_file = os.path.join(work_directory, INPUT_NAMES[input_format].format(scale))
+    if not os.path.exists(input_file):
+        print(f'Generating {input_file}', file=sys.stderr)
+        run(['generate-export.py', *options, '-n', str(scale), '-f', input_format, '-o', input_file])
+    return input_file
+
+
+def benchmark(tools, scales, work_directory, options, repeat):
+    """Return {tool: {scale: measurements}}, the best (fastest) of repeat runs of each."""
+    results = {}
+    for scale in scales:
+        for tool in tools:
+            input_format, command = TOOLS[tool]
+            input_file = generate(input_format, scale, work_directory, options)
+            best = None
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory(dir=work_directory) as output_directory:
+                    seconds, peak_rss = run(command(input_file, output_directory, options + ['-n', str(scale)]))
+                if best is None or seconds < best[0]:
+                    best = seconds, peak_rss
+            if input_format in ('v1', 'silence'):  # these converters write their output next to their input
+                os.remove(os.path.splitext(input_file)[0] + '.zip')
+            seconds, peak_rss = best
+            size = os.path.getsize(input_file)
+            results.setdefault(tool, {})[str(scale)] = {
+                'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss / 1e6, 1) if peak_rss else None,
+                'input_mb': round(size / 1e6, 1), 'mb_per_second': round(size / 1e6 / seconds, 1),
+                'messages_per_second': round(scale / seconds)}
+            print_result(tool, scale, results[tool][str(scale)])
+    return results
+
+
+def print_result(tool, scale, result, baseline=None, regressions=None):
+    line = f'{tool:<18} {scale:>9} messages {result["seconds"]:>9.2f} s ' \
+           f'{result["peak_rss_mb"] or float("nan"):>8.1f} MB RSS {result["mb_per_second"]:>8.1f} MB/s ' \
+           f'{result["messages_per_second"]:>9} messages/s'
+    if baseline:
+        line += f'  (time x{result["seconds"] / max(baseline["seconds"], 1e-3):.2f}'
+        if result['peak_rss_mb'] and baseline.get('peak_rss_mb'):
+            line += f', RSS x{result["peak_rss_mb"] / baseline["peak_rss_mb"]:.2f}'
+        line += ')'
+        if regressions:
+            line += ' REGRESSION: ' + ', '.join(regressions)
+    print(line)
+
+
+def compare(results, baseline, tolerance):
+    """Print the results against the baseline's, returning the number of regressions: runs that took longer or used
+    more memory than the baseline's by more than tolerance (a fraction), and, for time, by more than NOISE_SECONDS."""
+    count = 0
+    print(f'\nCompared with the baseline ({baseline.get("machine", "unknown machine")}, {baseline.get("date", "")}):')
+    for tool, scales in results['results'].items():
+        for scale, result in scales.items():
+            base = baseline['results'].get(tool, {}).get(scale)
+            if base is None:
+                continue
+            regressions = []
+            if result['seconds'] > base['seconds'] * (1 + tolerance) \
+                    and result['seconds'] - base['seconds'] > NOISE_SECONDS:
+                regressions.append('time')
+            if result['peak_rss_mb'] and base.get('peak_rss_mb') and \
+                    result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+                regressions.append('memory')
+            count += bool(regressions)
+            print_result(tool, int(scale), result, base, regressions)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the SMS Import / Export tools on synthetic data.')
+    parser.add_argument('--scales', default='1000,10000',
+                        help='comma separated numbers of messages to benchmark with (default: %(default)s)')
+    parser.add_argument('--tools', default=','.join(TOOLS),
+                        help='comma separated tools to benchmark (default: %(default)s)')
+    parser.add_argument('--attachment-size', type=int, default=100000,
+                        help='mean size of the generated attachments, in bytes (default: %(default)s)')
+    parser.add_argument('--mms-fraction', type=float, default=0.1,
+                        help='fraction of the generated messages that are MMS (default: %(default)s)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed for the generated data (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='run each benchmark this many times, and keep the fastest (default: %(default)s)')
+    parser.add_argument('-w', '--work-directory',
+                        help='directory for the generated inputs, which are kept, and reused by later runs with the '
+                             'same options (default: a temporary directory)')
+    parser.add_argument('-o', '--output', help='save the results to this JSON file (e.g. to use as a baseline)')
+    parser.add_argument('-b', '--baseline', help='compare the results with those saved in this JSON file')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='fraction by which a time or peak RSS may exceed the baseline\'s before it is reported '
+                             'as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    tools = args.tools.split(',')
+    if unknown := [tool for tool in tools if tool not in TOOLS]:
+        sys.exit(f'Unknown tools: {", ".join(unknown)} (known tools: {", ".join(TOOLS)})')
+    scales = [int(scale) for scale in args.scales.split(',')]
+    options = ['--attachment-size', str(args.attachment_size), '--mms-fraction', str(args.mms_fraction),
+               '--seed', str(args.seed)]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('options') != options:
+            print('Warning: the baseline was generated with different options: '
+                  + ' '.join(baseline.get('options', [])), file=sys.stderr)
+    if args.work_directory:
+        os.makedirs(args.work_directory, exist_ok=True)
+        work_directory = os.path.join(args.work_directory, '-'.join(options).replace('--', '').replace('.', '_'))
+        os.makedirs(work_directory, exist_ok=True)
+        results = benchmark(tools, scales, work_directory, options, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as work_directory:
+            results = benchmark(tools, scales, work_directory, options, args.repeat)
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': f'{platform.node()} ({platform.platform()}, '
+               f'Python {platform.python_version()}, {os.cpu_count()} CPUs)', 'options': options, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline and compare(results, baseline, args.tolerance):
+        sys.exit(1)
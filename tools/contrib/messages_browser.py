@@ -14,16 +14,56 @@
 # You should have received a copy of the GNU General Public License along with this
 # program. If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+from array import array
+import asyncio
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cProfile
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from getpass import getpass
+import gzip
 from html import escape
+from http.client import parse_headers
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler, HTTPStatus
+from io import BytesIO
 import json
+import os
 from os import path as os_path
+import pstats
 import re
-from sys import argv
-from zipfile import is_zipfile, ZipFile
+import sqlite3
+import struct
+from sys import byteorder, path as sys_path, stderr
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from zipfile import is_zipfile, ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+import zlib
 
 URL_REGEX = re.compile(r"(https?://*\S+)")
+LETTER_REGEX = re.compile(r"[^\W\d_]")
+NON_DIGIT_REGEX = re.compile(r"\D")
+
+READ_SIZE = 1 << 16  # bytes read from disk at a time
+CHECKPOINT_INTERVAL = 1 << 23  # uncompressed bytes between inflate checkpoints
+CACHE_SIZE = 10000  # parsed messages kept in memory
+DATA_CACHE_SIZE = 64  # attachment readers (and their inflate checkpoints) kept open
+ROW_CACHE_SIZE = 20000  # rendered messages kept in memory
+PAGE_SIZE = 500  # messages per thread page
+COMPRESS_MIN_SIZE = 1024  # smaller responses are sent uncompressed
+KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept open, with --asyncio
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+ROUTES = ("threads", "thread", "search", "data", "metrics", "other")
+SEARCH_BATCH = 10000  # messages added to the search index at a time
+SEARCH_LIMIT = 200  # most recent matches shown
+INDEX_SUFFIX = ".index"
+MIN_MATCH = 7  # trailing digits that phone numbers must share to be considered the same, as in Android
+PHONE_MIMETYPE = "vnd.android.cursor.item/phone_v2"
+ssef_files = {}  # encrypted (.ssef) export file name -> ssef.SSEFReader decrypting it
+INDEX_VERSION = f"3 {byteorder} " + "".join(str(array(t).itemsize) for t in "QIdq")  # arrays are stored raw
 
 base_html = '''
 <!DOCTYPE html><html lang=””><head><meta charset="utf-8">
@@ -87,25 +127,348 @@ div.thread.contact {
 div.thread.last {
   float: right;
 }
+div.older {
+  text-align: center;
+  margin: 1em;
+}
 br {
   clear: both;
 }
+form.search {
+  text-align: center;
+  margin: 1em;
+}
 </style></head><body>BODY</body></html>
 '''
 
-class Messages:
+class MemberReader:
+    """Random access to the bytes of a ZIP member (or of a plain file) without extracting it.
+
+    Reading a deflated member from an arbitrary offset would normally mean inflating
+    everything before it, so snapshots of the zlib decompressor are recorded every
+    CHECKPOINT_INTERVAL bytes as the member is read, and later reads resume from the
+    nearest one."""
+
+    def __init__(self, file_name, zinfo=None):
+        if file_name in ssef_files:  # decrypted as it is read, so there's no file descriptor
+            self.file, self.fd = ssef_files[file_name], None
+        else:
+            self.file = open(file_name, "rb", buffering=0)  # closed when the reader is garbage collected
+            self.fd = self.file.fileno()
+        self.lock = threading.Lock()
+        self.local = threading.local()  # per thread file objects, where there is no os.pread()
+        self.deflated = False
+        self.zinfo = zinfo
+        # Parallel lists: uncompressed offset -> (compressed offset, decompressor state)
+        self.cp_offsets = []
+        self.checkpoints = []
+        if zinfo is None:
+            self.start = 0
+            self.size = self.file.seek(0, os.SEEK_END) if self.fd is None else os.fstat(self.fd).st_size
+            self.length = self.size
+            return
+        self.length = zinfo.file_size
+        # Member data follows the 30 byte local header, file name and extra field
+        name_len, extra_len = struct.unpack("<2H", self.pread(30, zinfo.header_offset)[26:30])
+        self.start = zinfo.header_offset + 30 + name_len + extra_len
+        if zinfo.compress_type == ZIP_DEFLATED:
+            self.deflated = True
+            self.size = zinfo.compress_size
+            self.cp_offsets.append(0)
+            self.checkpoints.append((0, zlib.decompressobj(-zlib.MAX_WBITS)))
+        elif zinfo.compress_type == ZIP_STORED:
+            self.size = zinfo.file_size
+        else:
+            raise ValueError(f"{zinfo.filename}: unsupported compression method {zinfo.compress_type}")
+
+    def close(self):
+        if self.fd is not None:  # decrypting readers are shared
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def crc(self):
+        """CRC-32 recorded for the member, read from its local header or, if it has one, its data descriptor."""
+        header = self.pread(30, self.zinfo.header_offset)
+        if header[6] & 0x08:  # general purpose flag bit 3: CRC and sizes follow the data
+            descriptor = self.pread(8, self.start + self.size)
+            return struct.unpack("<L", descriptor[4:] if descriptor[:4] == b"PK\x07\x08" else descriptor[:4])[0]
+        return struct.unpack("<L", header[14:18])[0]
+
+    def pread(self, n, offset):
+        if self.fd is None:
+            return self.file.pread(n, offset)
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, n, offset)
+        # Without pread() (e.g. on Windows), each thread seeks its own file object
+        file = getattr(self.local, "file", None)
+        if file is None:
+            file = self.local.file = open(self.file.name, "rb", buffering=0)
+        file.seek(offset)
+        return file.read(n)
+
+    def chunks(self, start=0):
+        """Yield (offset, data) for consecutive uncompressed chunks, the first containing 'start'."""
+        if not self.deflated:
+            pos = start
+            while pos < self.size:
+                data = self.pread(min(READ_SIZE, self.size - pos), self.start + pos)
+                if not data:
+                    return
+                yield pos, data
+                pos += len(data)
+            return
+        with self.lock:
+            i = bisect_right(self.cp_offsets, start) - 1
+            pos = self.cp_offsets[i]
+            c_pos, decompressor = self.checkpoints[i]
+            decompressor = decompressor.copy()
+        while c_pos < self.size:
+            c_data = self.pread(min(READ_SIZE, self.size - c_pos), self.start + c_pos)
+            if not c_data:
+                return
+            c_pos += len(c_data)
+            data = decompressor.decompress(c_data)
+            if data:
+                yield pos, data
+                pos += len(data)
+            if pos - self.cp_offsets[-1] >= CHECKPOINT_INTERVAL:
+                with self.lock:
+                    if pos - self.cp_offsets[-1] >= CHECKPOINT_INTERVAL:
+                        self.cp_offsets.append(pos)
+                        self.checkpoints.append((c_pos, decompressor.copy()))
+
+    def lines(self):
+        """Yield (offset, line) for every line, in order, without the trailing newline."""
+        pending, offset = [], 0  # pieces of a line begun in earlier chunks, joined once its end is found
+        for _, data in self.chunks():
+            lines = data.split(b"\n")
+            if len(lines) == 1:
+                pending.append(data)
+                continue
+            if pending:
+                pending.append(lines[0])
+                lines[0] = b"".join(pending)
+                pending = []
+            rest = lines.pop()
+            if rest:
+                pending.append(rest)
+            for line in lines:
+                yield offset, line
+                offset += len(line) + 1
+        rest = b"".join(pending)
+        if rest:
+            yield offset, rest
+
+    def read_range(self, start, end):
+        """Yield the uncompressed bytes from start to end, in chunks."""
+        for pos, data in self.chunks(start):
+            if pos + len(data) <= start:
+                continue
+            yield data[max(start - pos, 0):end - pos]
+            if pos + len(data) >= end:
+                return
+
+    def read_many(self, spans):
+        """Return {offset: bytes} for (offset, length) spans, sharing inflate work between nearby spans."""
+        spans = sorted(set(spans))
+        if not self.deflated:
+            return {o: self.pread(n, self.start + o) for o, n in spans}
+        result = {}
+        i = 0
+        while i < len(spans):
+            buf_pos, buf = spans[i][0], bytearray()
+            for pos, data in self.chunks(buf_pos):
+                end = pos + len(data)
+                if end <= buf_pos:
+                    continue
+                buf += data[max(buf_pos - pos, 0):]
+                while i < len(spans) and spans[i][0] + spans[i][1] <= end:
+                    o, n = spans[i]
+                    result[o] = bytes(buf[o - buf_pos:o - buf_pos + n])
+                    i += 1
+                if i == len(spans):
+                    break
+                next_pos = spans[i][0]
+                if next_pos >= end:
+                    # Jump ahead if a later checkpoint saves inflating the gap
+                    if self.cp_offsets[bisect_right(self.cp_offsets, next_pos) - 1] > end:
+                        break
+                    buf_pos, buf = next_pos, bytearray()
+                else:
+                    del buf[:next_pos - buf_pos]
+                    buf_pos = next_pos
+            else:
+                raise EOFError(f"offset {spans[i][0]} is beyond the end of the data")
+        return result
+
+
+class LRUCache:
+    """A thread safe mapping holding only the 'size' most recently used items."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()  # least recently used first
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get_many(self, keys):
+        """Return {key: value} for those of keys that are present."""
+        found = {}
+        with self.lock:
+            for key in keys:
+                value = self.items.get(key)
+                if value is not None:
+                    self.items.move_to_end(key)
+                    found[key] = value
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            self.items.update(items)
+            for key in items:
+                self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+def normalize_number(address):
+    """The phone number address in E.164 style: its digits, after a "+" if it is international (written with "+" or
+    an "00" prefix); "" if it isn't a phone number (e.g. an e-mail address or an alphanumeric sender ID)."""
+    address = address.strip().replace("(0)", "")  # as in +44 (0)20 ..., where the 0 is only dialed nationally
+    if LETTER_REGEX.search(address):
+        return ""
+    digits = NON_DIGIT_REGEX.sub("", address)
+    if address.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    return digits
+
+
+class ContactIndex:
+    """The phone numbers in a contacts export, keyed by their last MIN_MATCH digits, so that the contact an address
+    belongs to is found with a dictionary lookup whatever format the number is written in (national or international,
+    with or without punctuation)."""
+
     def __init__(self):
-        self.zf = None
-        self.threads = {}
-        self.mdata = {}
+        self.labels = []  # contact number -> display name and phone numbers
+        self.suffixes = {}  # last MIN_MATCH digits (all of them, for shorter numbers) -> [(number, contact number)]
+        self.resolved = {}  # address, as written in messages -> contact number, or None
 
-    def open(self, messages_file):
-        if is_zipfile(messages_file):
-            self.zf = ZipFile(messages_file)
-        with self.zf.open("messages.ndjson") if self.zf else open(messages_file) as f:
-            self.messages = [json.loads(l) for l in f]
+    def load(self, f):
+        """Index the contacts in the JSON array in the binary file f."""
+        for contact in json.load(f):
+            numbers = []
+            for raw_contact in contact.get("raw_contacts", ()):
+                for datum in raw_contact.get("contacts_data", ()):
+                    if datum.get("mimetype") != PHONE_MIMETYPE:
+                        continue
+                    # data4 is the number normalized to E.164 by Android (if it could), data1 the number as entered
+                    number = normalize_number(datum.get("data4") or datum.get("data1") or "")
+                    if number and number not in numbers:
+                        numbers.append(number)
+            if numbers:
+                c_no = len(self.labels)
+                name = contact.get("display_name")
+                self.labels.append(" ".join([name] + numbers if name else numbers))
+                for number in numbers:
+                    self.suffixes.setdefault(number.lstrip("+")[-MIN_MATCH:], []).append((number, c_no))
+
+    def lookup(self, address):
+        """The number of the contact with the phone number address, or None."""
+        if address in self.resolved:
+            return self.resolved[address]
+        number = normalize_number(address)
+        best = None
+        for n, c_no in self.suffixes.get(number.lstrip("+")[-MIN_MATCH:], ()) if number else ():
+            # Numbers sharing their last digits match (as Android matches them), unless both are international, and
+            # so must be the same
+            if n != number and n.startswith("+") and number.startswith("+"):
+                continue
+            # If several contacts match, the one whose number shares the most trailing digits wins
+            shared = len(os_path.commonprefix([n[::-1], number[::-1]]))
+            if best is None or shared > best[0]:
+                best = shared, c_no
+        c_no = self.resolved[address] = best[1] if best else None
+        return c_no
+
+
+class Messages:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.messages_file = None
+        self.members = None  # ZIP member name -> ZipInfo, if messages_file is a ZIP file
+        self.reader = None
+        self.threads = {}  # thread id (or, for threads with a known contact, -1 - contact number) -> [date, label, msgs]
+        self.contacts_file = None
+        self.contacts = None  # ContactIndex, if a contacts export was given
+        # Per message, in file order: where its line is, and what the thread pages need
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.dates = array("d")  # seconds since the epoch
+        self.thread_ids = array("q")
+        self.outbound = bytearray()
+        # The index database (also holding the full text search index), and the temporary file it is built in
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.db_tmp_file = None
+        self.searchable = False
+        # Validators for pages derived from messages_file
+        self.etag = None
+        self.last_modified = None
+        self.cache = LRUCache(cache_size)  # parsed messages
+        self.row_cache = LRUCache(ROW_CACHE_SIZE)  # rendered messages
+        self.data_cache = LRUCache(DATA_CACHE_SIZE)  # attachment name -> MemberReader
+        self.load_times = {}  # phase -> seconds
 
-        for i, m in enumerate(self.messages):
+    def open(self, messages_file, index_file=None, contacts_file=None):
+        """Index messages_file, reusing index_file if it was built from the same export (and contacts_file), else
+        rebuilding it, with threads grouped and labeled by the contacts in contacts_file, if given."""
+        self.messages_file = messages_file
+        self.contacts_file = contacts_file
+        stats = [os.stat(name) for name in (messages_file, contacts_file) if name]  # pages depend on both
+        self.etag = '"' + "-".join(f"{st.st_size:x}-{st.st_mtime_ns:x}" for st in stats) + '"'
+        self.last_modified = max(int(st.st_mtime) for st in stats)
+        start = time.perf_counter()
+        if index_file and self.load_index(index_file):
+            self.load_times["index_load"] = time.perf_counter() - start
+            return
+        source = ssef_files.get(messages_file, messages_file)
+        if is_zipfile(source):
+            with ZipFile(source) as zf:
+                self.members = {zinfo.filename: zinfo for zinfo in zf.infolist()}
+            self.reader = MemberReader(messages_file, self.members["messages.ndjson"])
+        else:
+            self.reader = MemberReader(messages_file)
+        if contacts_file:
+            contacts_start = time.perf_counter()
+            self.contacts = ContactIndex()
+            with open(contacts_file, "rb") if contacts_file not in ssef_files else ssef_files[contacts_file] as f:
+                self.contacts.load(f)
+            self.load_times["contacts"] = time.perf_counter() - contacts_start
+        self.new_index(index_file)
+        self.scan()
+        save_start = time.perf_counter()
+        self.save_index(index_file)
+        self.load_times["index_save"] = time.perf_counter() - save_start
+        self.load_times["open"] = time.perf_counter() - start
+
+    def scan(self):
+        search_rows = []
+        parse_time = search_time = 0.0
+        start = time.perf_counter()
+        for offset, line in self.reader.lines():
+            if not line.strip():
+                continue
+            parse_start = time.perf_counter()
+            m = json.loads(line)
+            parse_time += time.perf_counter() - parse_start
             mms = False
             m_type = m.get("type", None)
             if not m_type:
@@ -116,139 +479,722 @@ class Messages:
             ts_date = int(m["date"])  # ms for SMS, s for MMS!
             if not mms:
                 ts_date /= 1000
-            m_date = datetime.fromtimestamp(ts_date)
 
-            # Attempt to get correspondent(s)...
-            address = ""
+            # Attempt to get correspondent(s), as (display name, address)...
+            correspondents = []
             if mms:
                 # MMS type: PduHeaders.
                 # BCC 0x81, CC 0x82, FROM 0x89, TO 0x97
                 if outbound and "__recipient_addresses" in m:
-                    for ra in m["__recipient_addresses"]:
-                        if "__display_name" in ra:
-                            address += ra["__display_name"] + " "
-                        if "address" in ra:
-                            address += ra["address"] + " "
+                    correspondents = [(ra.get("__display_name"), ra.get("address")) for ra in m["__recipient_addresses"]]
                 elif "__sender_address" in m:
                     sa = m["__sender_address"]
-                    if "__display_name" in sa:
-                        address = sa["__display_name"] + " "
-                    address += sa["address"]
-            if not address:
-                if "__display_name" in m:
-                    address = m["__display_name"] + " "
-                address += m.get("address", "")
-
+                    correspondents = [(sa.get("__display_name"), sa["address"])]
+            if not correspondents:
+                correspondents = [(m.get("__display_name"), m.get("address", ""))]
             t_id = int(m["thread_id"])
+            if self.contacts:
+                c_nos = [self.contacts.lookup(a) if a else None for _, a in correspondents]
+                if len(c_nos) == 1 and c_nos[0] is not None:
+                    # A conversation with a known contact, whatever number or thread its messages have
+                    t_id = -1 - c_nos[0]
+                # Known correspondents are labeled with their names and numbers from the contacts export
+                correspondents = [(self.contacts.labels[c_no], None) if c_no is not None else (name, a)
+                                  for (name, a), c_no in zip(correspondents, c_nos)]
+            address = " ".join(part for correspondent in correspondents for part in correspondent if part)
+
+            m_no = len(self.offsets)
+            self.offsets.append(offset)
+            self.lengths.append(len(line))
+            self.dates.append(ts_date)
+            self.outbound.append(outbound)
+
+            self.thread_ids.append(t_id)
             t = self.threads.get(t_id, None)
             if t:
                 if len(t[1]) < len(address):
                     t[1] = address
-                if t[0] < m_date:
-                    t[0] = m_date
+                if t[0] < ts_date:
+                    t[0] = ts_date
             else:
-                self.threads[t_id] = [m_date, address, []]  # list of msgs
+                t = self.threads[t_id] = [ts_date, address, array("I")]  # msgs
+            t[2].append(m_no)
 
-            self.mdata[i] = [m_date, t_id, outbound]
+            if self.searchable:
+                text = " ".join([m.get("body", "")] + [part.get("text", "") for part in m.get("__parts", [])
+                                                       if part.get("ct", None) == "text/plain"])
+                if text.strip():
+                    search_rows.append((m_no, text))
+                    if len(search_rows) == SEARCH_BATCH:
+                        search_start = time.perf_counter()
+                        self.db.executemany("INSERT INTO search (rowid, text) VALUES (?, ?)", search_rows)
+                        search_time += time.perf_counter() - search_start
+                        search_rows.clear()
+        if search_rows:
+            search_start = time.perf_counter()
+            self.db.executemany("INSERT INTO search (rowid, text) VALUES (?, ?)", search_rows)
+            search_time += time.perf_counter() - search_start
+        sort_start = time.perf_counter()
 
-        # Sort by m_date
+        # Sort threads by latest message, and each thread's messages by date
         self.threads = dict(sorted(self.threads.items(), key=lambda x: x[1][0], reverse=True))
-        self.mdata = dict(sorted(self.mdata.items(), key=lambda x: x[1][0]))
+        for t in self.threads.values():
+            t[2] = array("I", sorted(t[2], key=self.dates.__getitem__))
+        self.load_times.update(scan=sort_start - start, parse=parse_time, search_index=search_time,
+                               sort=time.perf_counter() - sort_start)
+
+    def index_key(self):
+        st = os.stat(self.messages_file)
+        key = {"version": INDEX_VERSION, "size": st.st_size, "mtime": st.st_mtime_ns, "contacts": ""}
+        if self.contacts_file:  # threads are grouped by contact
+            st = os.stat(self.contacts_file)
+            key["contacts"] = f"{os_path.abspath(self.contacts_file)} {st.st_size} {st.st_mtime_ns}"
+        return key
 
-        # Attach messages to threads in date order...
-        for m_no, v in self.mdata.items():
-            self.threads[v[1]][2].append(m_no)
+    def new_index(self, index_file):
+        """Start building the index in a temporary file next to index_file, or in memory if that fails or index_file is None."""
+        if index_file:
+            self.db_tmp_file = index_file + ".tmp"
+            try:
+                if os_path.exists(self.db_tmp_file):
+                    os.remove(self.db_tmp_file)
+                self.db = sqlite3.connect(self.db_tmp_file, check_same_thread=False)
+                self.db.executescript("""
+                    CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+                    CREATE TABLE arrays (name TEXT PRIMARY KEY, data BLOB);
+                    CREATE TABLE threads (pos INTEGER PRIMARY KEY, t_id INTEGER, last_date REAL, address TEXT, msgs BLOB);
+                    CREATE TABLE members (name TEXT PRIMARY KEY, header_offset INTEGER, compress_type INTEGER,
+                                          compress_size INTEGER, file_size INTEGER, crc INTEGER);
+                """)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Unable to save index to {index_file}: {e}")
+                self.db_tmp_file = None
+        if not self.db_tmp_file:
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            # rowid is the message number; the text itself is only needed to build the index
+            self.db.execute("CREATE VIRTUAL TABLE search USING fts5(text, content='', tokenize='unicode61 remove_diacritics 2')")
+            self.searchable = True
+        except sqlite3.OperationalError as e:
+            print(f"Search is unavailable: {e}")
+
+    def save_index(self, index_file):
+        """Complete the index being built, and atomically replace index_file with it."""
+        if not self.db_tmp_file:
+            self.db.commit()
+            return
+        try:
+            with self.db:
+                self.db.executemany("INSERT INTO meta VALUES (?, ?)", self.index_key().items())
+                self.db.executemany("INSERT INTO arrays VALUES (?, ?)",
+                                    [(name, bytes(getattr(self, name))) for name in
+                                     ("offsets", "lengths", "dates", "thread_ids", "outbound")])
+                self.db.executemany("INSERT INTO threads VALUES (?, ?, ?, ?, ?)",
+                                    [(pos, t_id, last_date, address, msgs.tobytes())
+                                     for pos, (t_id, (last_date, address, msgs)) in enumerate(self.threads.items())])
+                if self.members is not None:
+                    self.db.executemany("INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(name, z.header_offset, z.compress_type, z.compress_size, z.file_size, z.CRC)
+                                         for name, z in self.members.items()])
+            self.db.close()
+            os.replace(self.db_tmp_file, index_file)
+            self.db = sqlite3.connect(index_file, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Unable to save index to {index_file}: {e}")
+            self.db = sqlite3.connect(self.db_tmp_file, check_same_thread=False)
+        self.db_tmp_file = None
+
+    def load_index(self, index_file):
+        """Load the index from index_file if it matches messages_file; return whether it did."""
+        if not os_path.exists(index_file):
+            return False
+        db = sqlite3.connect(index_file, check_same_thread=False)
+        try:
+            if dict(db.execute("SELECT key, value FROM meta")) != self.index_key():
+                db.close()
+                return False
+            members = {}
+            for name, *values in db.execute("SELECT * FROM members"):
+                zinfo = members[name] = ZipInfo(name)
+                zinfo.header_offset, zinfo.compress_type, zinfo.compress_size, zinfo.file_size, zinfo.CRC = values
+            arrays = dict(db.execute("SELECT name, data FROM arrays"))
+            threads = db.execute("SELECT t_id, last_date, address, msgs FROM threads ORDER BY pos").fetchall()
+            self.searchable = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'search'").fetchone() is not None
+        except sqlite3.Error:
+            db.close()
+            return False
+        if members:
+            reader = MemberReader(self.messages_file, members["messages.ndjson"])
+            if reader.crc() != members["messages.ndjson"].CRC:
+                reader.close()
+                db.close()
+                return False
+            self.members = members
+        else:
+            reader = MemberReader(self.messages_file)
+        self.db = db
+        self.reader = reader
+        for name in ("offsets", "lengths", "dates", "thread_ids"):
+            getattr(self, name).frombytes(arrays[name])
+        self.outbound = bytearray(arrays["outbound"])
+        for t_id, last_date, address, msgs in threads:
+            self.threads[t_id] = [last_date, address, array("I", msgs)]
+        return True
+
+    def get_messages(self, m_nos):
+        """Return the parsed messages m_nos, reading those not in the cache in a single sweep."""
+        found = self.cache.get_many(m_nos)
+        missing = [m_no for m_no in m_nos if m_no not in found]
+        if missing:
+            lines = self.reader.read_many((self.offsets[m_no], self.lengths[m_no]) for m_no in missing)
+            parsed = {m_no: json.loads(lines[self.offsets[m_no]]) for m_no in missing}
+            self.cache.put_many(parsed)
+            found.update(parsed)
+        return [found[m_no] for m_no in m_nos]
+
+    def search_form(self, q="", address="", date_from="", date_to=""):
+        if not self.searchable:
+            return ""
+        return (f'<form class="search" action="/search"><input name="q" value="{escape(q)}" placeholder="Search">'
+                f' <input name="address" value="{escape(address)}" placeholder="Address" size="12">'
+                f' <input name="from" type="date" value="{escape(date_from)}">'
+                f' <input name="to" type="date" value="{escape(date_to)}"> <input type="submit" value="Search"></form>\n')
 
     def get_threads(self):
-        body = ""
+        body = [self.search_form()]
         for t_id, (m_date, address, _) in self.threads.items():
-            body += f'<div class="thread contact"><a href="/tid/{t_id}">{escape(address)}</a></div><div class="thread last">{m_date.strftime("%F %T")}</div><br>\n'
-        html = base_html.replace("TITLE", "Msgs").replace("BODY", body)
+            body.append(f'<div class="thread contact"><a href="/tid/{t_id}">{escape(address)}</a></div><div class="thread last">{datetime.fromtimestamp(m_date).strftime("%F %T")}</div><br>\n')
+        html = base_html.replace("TITLE", "Msgs").replace("BODY", "".join(body))
         return html.encode()
 
-    def get_thread(self, t_id):
-        _, address, msgs = self.threads[t_id]
-        body = ""
-        for m_no in msgs:
-            m_date, _, outbound = self.mdata[m_no]
-            body += f'<div class="date">{m_date.strftime("%F %T")}</div>'
-            body += '<div class="row from">' if outbound else '<div class="row to">'
-            m = self.messages[m_no]
-            text = escape(m.get("body", ""))
-            mms_parts = m.get("__parts", [])
-            for p_no, part in enumerate(mms_parts):
-                ptype = part.get("ct", None)
-                if ptype == "application/smil":
-                    continue  # ignore
-                if ptype == "text/plain":
-                    text += escape(part.get("text", ""))
+    def render_message(self, m_no, m):
+        """The message's body and parts, as a thread row."""
+        m_date = datetime.fromtimestamp(self.dates[m_no])
+        text = escape(m.get("body", ""))
+        mms_parts = m.get("__parts", [])
+        for p_no, part in enumerate(mms_parts):
+            ptype = part.get("ct", None)
+            if ptype == "application/smil":
+                continue  # ignore
+            if ptype == "text/plain":
+                text += escape(part.get("text", ""))
+            else:
+                cl = part.get("cl", "")
+                if len(cl) < 20:  # add date to short names
+                    text += f'<a href="/data/{m_no}_{p_no}/{m_date.strftime("%F")}-{cl}">{escape(cl)}</a><br>'
                 else:
-                    cl = part.get("cl", "")
-                    if len(cl) < 20:  # add date to short names
-                        text += f'<a href="/data/{m_no}_{p_no}/{m_date.strftime("%F")}-{cl}">{escape(cl)}</a><br>'
-                    else:
-                        text += f'<a href="/data/{m_no}_{p_no}/{cl}">{cl}</a><br>'
-            body += URL_REGEX.sub(r'<a href="\1">\1</a>', text).replace("\n", "<br>") + "</div>\n"
-        html = base_html.replace("TITLE", f"Msgs: {escape(address)}").replace("BODY", body)
+                    text += f'<a href="/data/{m_no}_{p_no}/{cl}">{cl}</a><br>'
+        row = '<div class="row from">' if self.outbound[m_no] else '<div class="row to">'
+        return row + URL_REGEX.sub(r'<a href="\1">\1</a>', text).replace("\n", "<br>") + "</div>\n"
+
+    def get_rows(self, m_nos):
+        """Return the rendered messages m_nos, rendering those not in the cache."""
+        found = self.row_cache.get_many(m_nos)
+        missing = [m_no for m_no in m_nos if m_no not in found]
+        if missing:
+            rendered = {m_no: self.render_message(m_no, m) for m_no, m in zip(missing, self.get_messages(missing))}
+            self.row_cache.put_many(rendered)
+            found.update(rendered)
+        return [found[m_no] for m_no in m_nos]
+
+    def get_thread(self, t_id, before=None):
+        """A page of the thread: the PAGE_SIZE messages before the timestamp 'before' (if given), oldest first."""
+        _, address, msgs = self.threads[t_id]
+        end = len(msgs) if before is None else bisect_left(msgs, before, key=self.dates.__getitem__)
+        start = max(end - PAGE_SIZE, 0)
+        # Don't split messages with the same date between pages
+        while 0 < start < end and self.dates[msgs[start - 1]] == self.dates[msgs[start]]:
+            start -= 1
+        page = msgs[start:end]
+        body = []
+        if start > 0:
+            body.append(f'<div class="older"><a href="/tid/{t_id}?before={self.dates[page[0]]!r}">Older messages</a></div>\n')
+        for m_no, row in zip(page, self.get_rows(page)):
+            body.append(f'<div class="date">{datetime.fromtimestamp(self.dates[m_no]).strftime("%F %T")}</div>')
+            body.append(row)
+        html = base_html.replace("TITLE", f"Msgs: {escape(address)}").replace("BODY", "".join(body))
+        return html.encode()
+
+    def search(self, q, address="", date_from=None, date_to=None, limit=SEARCH_LIMIT):
+        """Return the numbers of the most recent messages matching all the words of q, newest first.
+
+        A word ending in '*' matches any word starting with it. address, if given, restricts the
+        search to threads whose correspondents contain it; date_from and date_to are timestamps."""
+        terms = []
+        for word in q.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+        if not terms or not self.searchable:
+            return []
+        with self.db_lock:
+            m_nos = [row[0] for row in self.db.execute("SELECT rowid FROM search WHERE search MATCH ?", (" ".join(terms),))]
+        if address:
+            address = address.lower()
+            digits = "" if LETTER_REGEX.search(address) else NON_DIGIT_REGEX.sub("", address)  # phone numbers
+            t_ids = {t_id for t_id, (_, t_address, _) in self.threads.items() if address in t_address.lower()
+                     or (digits and digits in NON_DIGIT_REGEX.sub("", t_address))}
+            m_nos = [m_no for m_no in m_nos if self.thread_ids[m_no] in t_ids]
+        if date_from is not None:
+            m_nos = [m_no for m_no in m_nos if self.dates[m_no] >= date_from]
+        if date_to is not None:
+            m_nos = [m_no for m_no in m_nos if self.dates[m_no] < date_to]
+        m_nos.sort(key=self.dates.__getitem__, reverse=True)
+        return m_nos[:limit]
+
+    def get_search(self, query):
+        q, address, date_from, date_to = (query.get(k, [""])[0] for k in ("q", "address", "from", "to"))
+        body = self.search_form(q, address, date_from, date_to)
+        try:
+            ts_from = datetime.fromisoformat(date_from).timestamp() if date_from else None
+            ts_to = datetime.fromisoformat(date_to).timestamp() + 86400 if date_to else None  # inclusive
+        except ValueError:
+            ts_from = ts_to = None
+            body += '<div class="date">Invalid date</div>\n'
+        m_nos = self.search(q, address, ts_from, ts_to)
+        if q and not m_nos:
+            body += '<div class="date">No messages found</div>\n'
+        body = [body]
+        for m_no, row in zip(m_nos, self.get_rows(m_nos)):
+            t_id = self.thread_ids[m_no]
+            body.append(f'<div class="date"><a href="/tid/{t_id}">{escape(self.threads[t_id][1])}</a> '
+                        f'{datetime.fromtimestamp(self.dates[m_no]).strftime("%F %T")}</div>')
+            body.append(row)
+        html = base_html.replace("TITLE", f"Msgs: {escape(q)}").replace("BODY", "".join(body))
         return html.encode()
 
     def get_data(self, m_part):
+        """Return a MemberReader for the attachment, its content type, and its ETag."""
         m_no, p_no = map(int, m_part.split("_"))
-        part = self.messages[m_no]["__parts"][p_no]
+        part = self.get_messages([m_no])[0]["__parts"][p_no]
         data_type = part["ct"]
-        if self.zf:
-            with self.zf.open(os_path.join("data", os_path.basename(part["_data"])), "r") as f:
-                return f.read(), data_type
+        name = os_path.basename(part["_data"])
+        reader = self.data_cache.get_many([name]).get(name)
+        if reader is None:
+            if self.members is not None:
+                reader = MemberReader(self.messages_file, self.members["data/" + name])
+            else:
+                reader = MemberReader(os_path.join(data_path, name))
+            self.data_cache.put_many({name: reader})
+        if reader.zinfo:
+            etag = f'"{reader.zinfo.CRC:08x}-{reader.length:x}"'
         else:
-            with open(os_path.join(data_path, os_path.basename(part["_data"])), "rb") as f:
-                return f.read(), data_type
+            etag = f'"{reader.length:x}-{os.fstat(reader.fd).st_mtime_ns:x}"'
+        return reader, data_type, etag
+
+
+def parse_range(byte_range, length):
+    """Parse a single range Range header: return (start, end), None to ignore it, or False if it can't be satisfied."""
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", byte_range)
+    if not match or not (match[1] or match[2]):
+        return None  # malformed, or multiple ranges
+    if match[1]:
+        start = int(match[1])
+        if match[2] and int(match[2]) < start:
+            return None
+        end = min(int(match[2]) + 1, length) if match[2] else length
+    else:
+        start, end = max(length - int(match[2]), 0), length
+    return (start, end) if start < end else False
+
+
+def benchmark(messages, max_threads):
+    """Read every attachment with 1, 2, 4 ... max_threads threads, checking CRCs, and print the throughput."""
+    names = set()
+    for m_no in range(0, len(messages.offsets), CACHE_SIZE):
+        for m in messages.get_messages(range(m_no, min(m_no + CACHE_SIZE, len(messages.offsets)))):
+            names.update(os_path.basename(part["_data"]) for part in m.get("__parts", []) if "_data" in part)
+    if messages.members is not None:
+        sources = [(messages.messages_file, messages.members["data/" + name]) for name in names
+                   if "data/" + name in messages.members]
+    else:
+        sources = [(os_path.join(data_path, name), None) for name in names if os_path.exists(os_path.join(data_path, name))]
+    if not sources:
+        print("No attachments to read")
+        return
+
+    def fetch(source):
+        reader = MemberReader(*source)
+        crc = 0
+        for data in reader.read_range(0, reader.length):
+            crc = zlib.crc32(data, crc)
+        if reader.zinfo and crc != reader.zinfo.CRC:
+            raise ValueError(f"{reader.zinfo.filename}: bad CRC")
+        reader.close()
+        return reader.length
+
+    threads = 1
+    while True:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            total = sum(executor.map(fetch, sources))
+        elapsed = time.perf_counter() - start
+        print(f"{threads:3} threads: {len(sources)} attachments, {total / 1e6:.1f} MB in {elapsed:.2f} s "
+              f"({total / 1e6 / elapsed:.1f} MB/s, {len(sources) / elapsed:.0f} attachments/s)")
+        if threads >= max_threads:
+            break
+        threads = min(threads * 2, max_threads)
+
+
+class Metrics:
+    """Request latency histograms, reported with the messages' load times and cache statistics in
+    the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {route: [0] * (len(LATENCY_BUCKETS) + 1) for route in ROUTES}  # the last is +Inf
+        self.sums = dict.fromkeys(ROUTES, 0.0)
+
+    def observe(self, route, seconds):
+        with self.lock:
+            self.buckets[route][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.sums[route] += seconds
+
+    def render(self, messages):
+        lines = ["# HELP messages_browser_load_seconds Time taken by each phase of loading the messages file.",
+                 "# TYPE messages_browser_load_seconds gauge"]
+        lines += [f'messages_browser_load_seconds{{phase="{phase}"}} {seconds:.6f}'
+                  for phase, seconds in messages.load_times.items()]
+        lines += ["# HELP messages_browser_messages Messages in the messages file.",
+                  "# TYPE messages_browser_messages gauge", f"messages_browser_messages {len(messages.offsets)}",
+                  "# HELP messages_browser_threads Threads in the messages file.",
+                  "# TYPE messages_browser_threads gauge", f"messages_browser_threads {len(messages.threads)}"]
+        caches = {"messages": messages.cache, "rows": messages.row_cache, "data": messages.data_cache}
+        for name, kind, help_text, attr in (("hits_total", "counter", "Cache lookups that found the item.", "hits"),
+                                            ("misses_total", "counter", "Cache lookups that did not find the item.", "misses"),
+                                            ("items", "gauge", "Items in the cache.", "items")):
+            lines += [f"# HELP messages_browser_cache_{name} {help_text}", f"# TYPE messages_browser_cache_{name} {kind}"]
+            lines += [f'messages_browser_cache_{name}{{cache="{cache}"}} '
+                      f'{len(c.items) if attr == "items" else getattr(c, attr)}' for cache, c in caches.items()]
+        lines += ["# HELP messages_browser_request_duration_seconds Time taken to handle requests, by route.",
+                  "# TYPE messages_browser_request_duration_seconds histogram"]
+        with self.lock:
+            for route in ROUTES:
+                count = 0
+                for le, n in zip(LATENCY_BUCKETS + ("+Inf",), self.buckets[route]):
+                    count += n
+                    lines.append(f'messages_browser_request_duration_seconds_bucket{{route="{route}",le="{le}"}} {count}')
+                lines.append(f'messages_browser_request_duration_seconds_sum{{route="{route}"}} {self.sums[route]:.6f}')
+                lines.append(f'messages_browser_request_duration_seconds_count{{route="{route}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def route_of(path):
+    """The route (one of ROUTES) that handles path, as used in metrics and for --profile."""
+    path = urlsplit(path).path
+    if path == "/":
+        return "threads"
+    for prefix, route in (("/tid/", "thread"), ("/search", "search"), ("/data/", "data"), ("/metrics", "metrics")):
+        if path.startswith(prefix):
+            return route
+    return "other"
+
+
+def profiled(function, *args):
+    """Call function(*args) under cProfile, and print the statistics to stderr."""
+    with profile_lock:  # only one profiler can be active at a time
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, *args)
+    pstats.Stats(profiler, stream=stderr).sort_stats("cumulative").print_stats(25)
+    return result
+
+
+class Response:
+    """An HTTP response, whose body is either bytes or a range of an attachment: (reader, start, end)."""
+
+    def __init__(self, status=HTTPStatus.OK, headers=(), body=b"", data_range=None):
+        self.status = status
+        self.headers = list(headers)
+        self.body = body
+        self.data_range = data_range
+        length = data_range[2] - data_range[1] if data_range else len(body)
+        self.headers.append(("Content-Length", str(length)))
+
+
+def validators(etag=None):
+    return [("ETag", etag or messages.etag), ("Last-Modified", formatdate(messages.last_modified, usegmt=True)),
+            ("Cache-Control", "no-cache")]
+
+
+def not_modified(headers, etag=None):
+    """Whether the client's copy (of a page derived from the messages file, by default) is current."""
+    etag = etag or messages.etag
+    if_none_match = headers.get("If-None-Match")
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_none_match:
+        # Compressed copies have their encoding appended to the ETag
+        current = {etag} | {f'{etag[:-1]}-{encoding}"' for encoding in ("gzip", "deflate")}
+        return if_none_match.strip() == "*" or any(t.strip().removeprefix("W/") in current for t in if_none_match.split(","))
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= messages.last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def accepted_encoding(accept_encoding):
+    """The compression to use, gzip or deflate, according to an Accept-Encoding header (or None)."""
+    q_values = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        match = re.search(r"q\s*=\s*([\d.]+)", params)
+        try:
+            q_values[coding.strip().lower()] = float(match[1]) if match else 1.0
+        except ValueError:
+            pass
+    for encoding in ("gzip", "deflate"):
+        if q_values.get(encoding, q_values.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def page_response(headers, data, cont_type="text/html; charset=UTF-8", validate=True):
+    """A response with data, compressed if the client accepts it; if validate, with validators so that the
+    client can revalidate its copy with a conditional request."""
+    response_headers = [("Content-Type", cont_type)]
+    etag = None
+    if len(data) >= COMPRESS_MIN_SIZE and (cont_type.startswith("text/") or "json" in cont_type):
+        encoding = accepted_encoding(headers.get("Accept-Encoding"))
+        if encoding:
+            data = gzip.compress(data, 6) if encoding == "gzip" else zlib.compress(data, 6)
+            response_headers += [("Content-Encoding", encoding), ("Vary", "Accept-Encoding")]
+            etag = f'{messages.etag[:-1]}-{encoding}"'
+    if validate:
+        response_headers += validators(etag)
+    else:
+        response_headers += [("pragma", "no-cache"), ("Cache-Control", "no-store"), ("Cache-Control", "no-cache")]
+    return Response(headers=response_headers, body=data)
+
+
+def data_response(headers, reader, cont_type, etag):
+    """A response with an attachment, or the part of it requested by a Range header."""
+    if not_modified(headers, etag):
+        return Response(HTTPStatus.NOT_MODIFIED, validators(etag))
+    start, end = 0, reader.length
+    byte_range = headers.get("Range")
+    if_range = headers.get("If-Range")
+    if byte_range and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range(byte_range, reader.length)
+        if byte_range is False:
+            return Response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, [("Content-Range", f"bytes */{reader.length}")])
+        if byte_range:
+            start, end = byte_range
+    response_headers = [("Content-Type", cont_type), ("Accept-Ranges", "bytes")] + validators(etag)
+    if end - start < reader.length:
+        response_headers.append(("Content-Range", f"bytes {start}-{end - 1}/{reader.length}"))
+        return Response(HTTPStatus.PARTIAL_CONTENT, response_headers, data_range=(reader, start, end))
+    return Response(HTTPStatus.OK, response_headers, data_range=(reader, start, end))
+
+
+def error_response(status):
+    return Response(status, [("Content-Type", "text/plain; charset=UTF-8")], f"{status} {status.phrase}\n".encode())
+
+
+def respond(path, headers):
+    """Handle a GET request for path, under cProfile if it is for the --profile route."""
+    if profile_route == route_of(path):
+        return profiled(route, path, headers)
+    return route(path, headers)
+
+
+def route(path, headers):
+    tid = "/tid/"
+    url = urlsplit(path)
+    query = parse_qs(url.query)
+    if path == "/favicon.ico":
+        return page_response(headers, b'', 'image/x-icon', validate=False)
+    try:
+        if url.path.startswith("/data/"):
+            m_part = url.path.split("/")[2]
+            try:
+                data = messages.get_data(m_part)
+            except (KeyError, IndexError, ValueError, FileNotFoundError):
+                return error_response(HTTPStatus.NOT_FOUND)
+            return data_response(headers, *data)
+        if not_modified(headers):
+            return Response(HTTPStatus.NOT_MODIFIED, validators())
+        elif url.path.startswith(tid):
+            t_id = int(url.path[len(tid) :])
+            before = float(query["before"][0]) if "before" in query else None
+            return page_response(headers, messages.get_thread(t_id, before))
+        elif url.path == "/search":
+            return page_response(headers, messages.get_search(query))
+        elif url.path == "/metrics":
+            return page_response(headers, metrics.render(messages).encode(), "text/plain; version=0.0.4; charset=utf-8",
+                                 validate=False)
+        return page_response(headers, messages.get_threads())
+    except (KeyError, ValueError):
+        return error_response(HTTPStatus.NOT_FOUND)
 
 
 class Handler(BaseHTTPRequestHandler):
 
     protocol_version = "HTTP/1.1"  # requires accurate content-length`
 
-    def send_with_headers(self, data, cont_type="text/html; charset=UTF-8"):
-        self.send_response(HTTPStatus.OK)
-        self.send_header("Content-Type", cont_type)
-        self.send_header("pragma", "no-cache")
-        self.send_header("Cache-Control", "no-store")
-        self.send_header("Cache-Control", "no-cache")
-        self.send_header("Content-Length", str(len(data)))
+    def do_GET(self):
+        start = time.perf_counter()
+        try:
+            self.respond()
+        finally:
+            metrics.observe(route_of(self.path), time.perf_counter() - start)
+
+    def respond(self):
+        response = respond(self.path, self.headers)
+        self.send_response(response.status)
+        for header in response.headers:
+            self.send_header(*header)
         self.end_headers()
-        self.wfile.write(data)
+        try:
+            if not response.data_range:
+                self.wfile.write(response.body)
+                return
+            reader, start, end = response.data_range
+            if not reader.deflated and reader.fd is not None and hasattr(os, "sendfile"):
+                offset, remaining = reader.start + start, end - start
+                while remaining > 0:
+                    sent = os.sendfile(self.connection.fileno(), reader.fd, offset, remaining)
+                    if not sent:
+                        raise EOFError(f"{reader.file.name} is truncated")
+                    offset += sent
+                    remaining -= sent
+            else:
+                for data in reader.read_range(start, end):
+                    self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # e.g. a media player seeking elsewhere
 
-    def do_GET(self):
-        tid = "/tid/"
-        if self.path == "/favicon.ico":
-            self.send_with_headers(b'', 'image/x-icon')
-            return
-        elif self.path.startswith(tid):
-            t_id = int(self.path[len(tid) :])
-            self.send_with_headers(messages.get_thread(t_id))
-            return
-        elif self.path.startswith("/data/"):
-            m_part = self.path.split("/")[2]
-            self.send_with_headers(*messages.get_data(m_part))
-            return
-        self.send_with_headers(messages.get_threads())
+
+async def serve_connection(stream_reader, writer, executor):
+    """Serve HTTP/1.1 requests on a connection until the client closes it (or it is idle too long).
+
+    Everything that might block, rendering pages and reading from the messages file, runs in executor."""
+    loop = asyncio.get_running_loop()
+    client = writer.get_extra_info("peername")[0]
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(stream_reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                break
+            request_line, _, header_block = head.partition(b"\r\n")
+            request_line = request_line.decode("latin-1")
+            try:
+                method, path, version = request_line.split()
+            except ValueError:
+                method, path, version = None, None, "HTTP/1.0"
+            headers = parse_headers(BytesIO(header_block))
+            if headers.get("Content-Length"):
+                await stream_reader.readexactly(int(headers["Content-Length"]))  # not used
+            connection = headers.get("Connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            start = time.perf_counter()
+            if method == "GET":
+                response = await loop.run_in_executor(executor, respond, path, headers)
+            elif method:
+                response = error_response(HTTPStatus.NOT_IMPLEMENTED)
+            else:
+                response = error_response(HTTPStatus.BAD_REQUEST)
+                keep_alive = False
+            head = [f"HTTP/1.1 {response.status.value} {response.status.phrase}",
+                    f"Date: {formatdate(usegmt=True)}"] + [f"{k}: {v}" for k, v in response.headers]
+            if not keep_alive:
+                head.append("Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            if response.data_range:
+                reader, first, last = response.data_range
+                if not reader.deflated and reader.fd is not None:
+                    await writer.drain()
+                    await loop.sendfile(writer.transport, reader.file, reader.start + first, last - first)
+                else:
+                    chunks = reader.read_range(first, last)
+                    while (data := await loop.run_in_executor(executor, next, chunks, None)) is not None:
+                        writer.write(data)
+                        await writer.drain()
+            else:
+                writer.write(response.body)
+            await writer.drain()
+            if method == "GET":
+                metrics.observe(route_of(path), time.perf_counter() - start)
+            stderr.write(f'{client} - - [{datetime.now().strftime("%d/%b/%Y %H:%M:%S")}] "{request_line}" {response.status.value} -\n')
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass  # e.g. a media player seeking elsewhere, or a malformed request
+    finally:
+        writer.close()
+
+
+async def serve_asyncio(host, port, workers):
+    executor = ThreadPoolExecutor(workers)
+    server = await asyncio.start_server(lambda r, w: serve_connection(r, w, executor), host, port)
+    async with server:
+        await server.serve_forever()
 
 
 if __name__ == "__main__":
-    if len(argv) < 2:
-        print(f"Usage: {argv[0]} messages-YYYY-MM-DD.zip")
-        exit()
+    parser = argparse.ArgumentParser(description="browse SMS and MMS messages exported by SMS Import / Export")
+    parser.add_argument("messages_file", help="messages-YYYY-MM-DD.zip (or an unzipped messages.ndjson)")
+    parser.add_argument("-c", "--cache", type=int, default=CACHE_SIZE,
+                        help="number of parsed messages to keep in memory (default: %(default)s)")
+    parser.add_argument("-i", "--index",
+                        help="index file to use (default: messages_file with '.index' appended, or none, keeping the "
+                             "index in memory, if messages_file or the contacts file is encrypted)")
+    parser.add_argument("--contacts", metavar="CONTACTS_FILE",
+                        help="contacts-YYYY-MM-DD.json, whose names label threads, which are grouped by contact")
+    parser.add_argument("--no-index", action="store_true", help="index messages_file from scratch, and don't save it")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="serve with an asyncio event loop (with keep-alive, and a bounded pool of worker threads) "
+                             "instead of a thread per connection")
+    parser.add_argument("-w", "--workers", type=int, default=min(32, (os.cpu_count() or 1) + 4),
+                        help="worker threads for --asyncio (default: %(default)s)")
+    parser.add_argument("--profile", choices=("load",) + ROUTES,
+                        help="print cProfile statistics for loading the messages file, or for each request to a route")
+    parser.add_argument("--benchmark", type=int, metavar="THREADS",
+                        help="instead of serving, time reading all attachments with up to THREADS concurrent readers")
+    args = parser.parse_args()
 
-    messages_file = argv[1]
+    messages_file = args.messages_file
     data_path = os_path.join(os_path.dirname(messages_file), "data") # in case not zip
-    messages = Messages()
-    messages.open(messages_file)
+    messages = Messages(args.cache)
+    metrics = Metrics()
+    profile_route = args.profile
+    profile_lock = threading.Lock()
+    # The index holds message text and contact names, so it isn't saved for encrypted files unless --index is given
+    encrypted = any(file_name and file_name.endswith(".ssef") for file_name in (messages_file, args.contacts))
+    index_file = None if args.no_index or (encrypted and not args.index) else args.index or messages_file + INDEX_SUFFIX
+    passphrase = None  # asked for once, for the messages and contacts files
+    for file_name in (messages_file, args.contacts):
+        if file_name and file_name.endswith(".ssef"):
+            sys_path.insert(0, os_path.dirname(os_path.dirname(os_path.abspath(__file__))))  # ssef.py is in tools/
+            import ssef  # requires PyNaCl
+            if passphrase is None:
+                passphrase = getpass("Enter passphrase: ")
+            try:
+                ssef_files[file_name] = ssef.SSEFReader(file_name, passphrase)
+                ssef_files[file_name].pread(1, 0)  # fails here if the passphrase is wrong
+            except ssef.SSEFError as e:
+                exit(str(e))
+    if profile_route == "load":
+        profiled(messages.open, messages_file, index_file, args.contacts)
+    else:
+        messages.open(messages_file, index_file, args.contacts)
+    if args.benchmark:
+        benchmark(messages, args.benchmark)
+        exit()
 
     # with open("msg-base.html", "r") as f:
     #     base_html = f.read()
 
-    httpserv = ThreadingHTTPServer(("0.0.0.0", 8222), Handler)
     print("Serving messages browser here: http://127.0.0.1:8222/ - use <Ctrl-C> to stop")
+    if args.asyncio:
+        try:
+            asyncio.run(serve_asyncio("0.0.0.0", 8222, args.workers))
+        except (KeyboardInterrupt, SystemExit):
+            print("BREAK! Done.")
+        exit()
+    httpserv = ThreadingHTTPServer(("0.0.0.0", 8222), Handler)
     try:
         httpserv.serve_forever()
     except (KeyboardInterrupt, SystemExit):
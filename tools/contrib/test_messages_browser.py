@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+
+# Tests for messages_browser.py; run with: python3 -m unittest test_messages_browser (from this directory)
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import tempfile
+import threading
+import unittest
+import zipfile
+
+import messages_browser
+
+ATTACHMENT = bytes(range(256)) * 4096  # 1 MiB
+
+
+class AsyncioMetricsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        messages_file = os.path.join(directory.name, "messages.zip")
+        mms = {"date": "1700000000", "msg_box": "1", "thread_id": "1",
+               "__sender_address": {"address": "+15550100", "type": "137"},
+               "__parts": [{"ct": "image/jpeg", "_data": "/data/user/0/com.android.providers.telephony/app_parts/"
+                                                         "PART_1.jpg"},
+                           {"ct": "image/png", "_data": "/data/user/0/com.android.providers.telephony/app_parts/"
+                                                        "PART_2.png"}]}
+        with zipfile.ZipFile(messages_file, "w") as z:
+            z.writestr("messages.ndjson", json.dumps(mms) + "\n")
+            z.writestr("data/PART_1.jpg", ATTACHMENT, zipfile.ZIP_STORED)  # sent with sendfile
+            z.writestr("data/PART_2.png", ATTACHMENT, zipfile.ZIP_DEFLATED)  # read in the executor
+        messages = messages_browser.Messages(messages_browser.CACHE_SIZE)
+        messages.open(messages_file)
+        for name, value in (("messages", messages), ("metrics", messages_browser.Metrics()), ("profile_route", None),
+                            ("profile_lock", threading.Lock())):
+            setattr(messages_browser, name, value)
+
+    async def get(self, port, path, headers):
+        stream_reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n"
+        writer.write((request + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n").encode("latin-1"))
+        response = await stream_reader.read()
+        writer.close()
+        return response
+
+    async def serve(self, requests):
+        executor = ThreadPoolExecutor(2)
+        server = await asyncio.start_server(
+            lambda r, w: messages_browser.serve_connection(r, w, executor), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            responses = [await self.get(port, path, headers) for path, headers in requests]
+        executor.shutdown()
+        return responses
+
+    def test_data_range_latency(self):
+        start, end = 600000, 700000
+        responses = asyncio.run(self.serve([(f"/data/0_{p_no}/part", {"Range": f"bytes={start}-{end - 1}"})
+                                            for p_no in (0, 1)]))
+        for response in responses:
+            head, _, body = response.partition(b"\r\n\r\n")
+            self.assertTrue(head.startswith(b"HTTP/1.1 206 "))
+            self.assertEqual(body, ATTACHMENT[start:end])
+        metrics = messages_browser.metrics
+        self.assertEqual(sum(metrics.buckets["data"]), 2)
+        self.assertEqual(metrics.buckets["data"][-1], 0)  # none in the +Inf bucket
+        self.assertGreaterEqual(metrics.sums["data"], 0)
+        self.assertLess(metrics.sums["data"], messages_browser.LATENCY_BUCKETS[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,8 +22,115 @@
 
 # Written for https://github.com/tmo1/sms-ie/issues/100
 
+# Usage: 'csv-convert.py < messages.csv > messages.json' (SMS I/E 'v1' format)
+#        'csv-convert.py [-m mapping.json] -o messages-xxx.zip [messages.csv]' (SMS I/E 'v2' format)
+# With -o, the rows are converted one at a time and written to the zip file's messages.ndjson (by the sms_ie package,
+# which buffers them), so memory use does not depend on the size of the CSV. A mapping file gives the output fields,
+# and how to compute each of them from the row's columns; see Tools.md.
+
+import argparse
 import csv
 import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from sms_ie import ExportWriter
+
+
+def column_converter(spec):
+    """Return a function computing a field's value (or None, to leave it out) from a row, as given by its spec in the
+    mapping file: a column name, or an object with a "column" and a "type" ("string", "date", "seconds" or "map") and
+    type specific options, or with a constant "value"."""
+    if isinstance(spec, str):
+        spec = {'column': spec}
+    if 'value' in spec:
+        value = str(spec['value'])
+        return lambda row: value
+    column = spec['column']
+    kind = spec.get('type', 'string')
+    if kind == 'string':
+        def convert(value):
+            return value
+    elif kind == 'date':  # to milliseconds since the epoch, as Android stores dates
+        date_format = spec.get('format')
+        tz = timezone.utc if spec.get('utc') else None  # otherwise, dates without a time zone are in local time
+
+        def convert(value):
+            date = datetime.strptime(value, date_format) if date_format else datetime.fromisoformat(value)
+            if tz and date.tzinfo is None:
+                date = date.replace(tzinfo=tz)
+            return str(int(date.timestamp() * 1000))
+    elif kind == 'seconds':  # seconds since the epoch, to milliseconds
+        def convert(value):
+            return str(int(float(value) * 1000))
+    elif kind == 'map':  # e.g. {"column": "Direction", "type": "map", "values": {"Incoming": "1", "Outgoing": "2"}}
+        values = {k: str(v) for k, v in spec['values'].items()}
+        default = spec.get('default')
+
+        def convert(value):
+            if value in values:
+                return values[value]
+            if default is None:
+                raise ValueError(f'Unexpected value {value!r} in column {column!r}')
+            return str(default)
+    else:
+        raise ValueError(f'Unknown column type {kind!r}')
+    return lambda row: convert(row[column]) if row.get(column) else None
+
+
+def mapped_columns(mapping):
+    """Return the CSV columns the mapping's fields are computed from."""
+    specs = ({'column': spec} if isinstance(spec, str) else spec for spec in mapping.values())
+    return {spec['column'] for spec in specs if 'value' not in spec}
+
+
+def convert_rows(rows, mapping):
+    """Yield each row converted to a message, according to the mapping (if any)."""
+    if mapping is None:
+        yield from rows
+        return
+    converters = [(field, column_converter(spec)) for field, spec in mapping.items()]
+    for line_number, row in enumerate(rows, 2):
+        message = {}
+        for field, convert in converters:
+            try:
+                value = convert(row)
+            except ValueError as e:
+                raise ValueError(f'Line {line_number}, field {field}: {e!r}') from e
+            if value is not None:
+                message[field] = value
+        yield message
+
 
-print(json.dumps(list(csv.DictReader(open(0, newline=''))), indent=2, ensure_ascii=False))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert SMS messages in CSV format to SMS Import / Export format')
+    parser.add_argument('input_file', nargs='?', help='CSV file (default: standard input)')
+    parser.add_argument('-o', '--output', help="write the messages to this zip file in 'v2' format")
+    parser.add_argument('-m', '--mapping',
+                        help='JSON file mapping output fields to CSV columns (default: use the columns as they are)')
+    parser.add_argument('-d', '--delimiter', default=',', help='CSV field delimiter (default: %(default)r)')
+    args = parser.parse_args()
 
+    mapping = None
+    if args.mapping:
+        with open(args.mapping) as f:
+            mapping = json.load(f)
+    with open(args.input_file or 0, newline='') as f:
+        rows = csv.DictReader(f, delimiter=args.delimiter)
+        if mapping is not None:
+            missing = mapped_columns(mapping) - set(rows.fieldnames or ())
+            if missing:
+                sys.exit(f'Columns not in the CSV file: {", ".join(sorted(missing))}')
+        messages = convert_rows(rows, mapping)
+        try:
+            if not args.output:
+                print(json.dumps(list(messages), indent=2, ensure_ascii=False))
+            else:
+                with ExportWriter(args.output) as messages_zip:
+                    for message in messages:
+                        messages_zip.write(message)
+        except ValueError as e:
+            if args.output:
+                os.remove(args.output)  # rather than leave a partial export
+            sys.exit(str(e))
@@ -0,0 +1,261 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: delta-export.py create -o delta.zip messages-old.zip messages-new.zip
+#        delta-export.py apply -o messages-new.zip messages-old.zip delta-1.zip [delta-2.zip ...]
+# Stores a series of messages exports (e.g. nightly ones) as a full export and a chain of deltas, each holding only
+# what changed since the export before it.
+#
+# A delta is a messages zip file containing the messages that are new or changed (so importing it on its own adds them
+# to a device that already has the older messages), the attachments they refer to and those that weren't in the older
+# export (or whose contents differ from those stored under the same name, as told by the CRC and size recorded in the
+# zip file, so attachments aren't read), and delta.json, which records how to rebuild the newer export's
+# messages.ndjson from the older one's lines and its own, as ranges of lines, and which attachments were dropped. A
+# message is matched by a hash of its whole line (so e.g. marking a message read counts as a change) and of the
+# identity of its attachments, so the rebuilt export has exactly the newer one's lines, which is checked by a digest
+# of them.
+#
+# Creating a delta keeps an index of the older export's messages in memory (roughly 100 bytes a message); applying
+# deltas spools each rebuilt messages.ndjson to a temporary file, and copies the attachments once, at the end, without
+# decompressing them.
+
+import argparse
+from array import array
+from getpass import getpass
+import hashlib
+import json
+import sys
+import tempfile
+
+from sms_ie import ExportError, ExportReader, ExportWriter, loads
+
+MANIFEST = 'delta.json'
+FORMAT_VERSION = 1
+OLDER, DELTA = 0, 1  # the sources of the ranges of lines in a delta's order
+
+
+def attachment_identity(attachment):
+    return [attachment.name, attachment.info.CRC, attachment.size] if attachment else None
+
+
+def fingerprint(line, reader):
+    """Return a message's fingerprint (an int): a hash of its line, and of the identity of its attachments."""
+    h = hashlib.blake2b(line, digest_size=8)
+    if b'"_data"' in line:
+        h.update(json.dumps([attachment_identity(attachment) for part, attachment
+                             in reader.parts(loads(line))]).encode())
+    return int.from_bytes(h.digest(), 'big')
+
+
+def extend(order, source, position):
+    """Add a line to order, a list of [source, start, count] ranges of lines, extending the last range if it can."""
+    if order and order[-1][0] == source and order[-1][1] + order[-1][2] == position:
+        order[-1][2] += 1
+    else:
+        order.append([source, position, 1])
+
+
+def index_messages(reader):
+    """Return ({fingerprint: position, or list of positions for duplicates}, count, digest) for reader's messages."""
+    index = {}
+    digest = hashlib.blake2b()
+    count = 0
+    for count, line in enumerate(reader.lines(), 1):
+        digest.update(line + b'\n')
+        key = fingerprint(line, reader)
+        if key not in index:
+            index[key] = count - 1
+        elif isinstance(index[key], list):
+            index[key].append(count - 1)
+        else:
+            index[key] = [index[key], count - 1]
+    return index, count, digest.hexdigest()
+
+
+def take(index, key):
+    """Remove and return the (first remaining) position of a message with fingerprint key, or None."""
+    positions = index.get(key)
+    if positions is None:
+        return None
+    if not isinstance(positions, list):
+        del index[key]
+        return positions
+    position = positions.pop(0)
+    if not positions:
+        del index[key]
+    return position
+
+
+def create(older, newer, writer):
+    """Write the delta from older to newer (ExportReaders) to writer, returning a dictionary of statistics."""
+    index, older_count, older_digest = index_messages(older)
+    order = []
+    digest = hashlib.blake2b()
+    count = changed = 0
+    referenced = set()  # attachments of new or changed messages, which the delta needs to be importable
+    for count, line in enumerate(newer.lines(), 1):
+        digest.update(line + b'\n')
+        position = take(index, fingerprint(line, newer))
+        if position is None:
+            extend(order, DELTA, changed)
+            writer.write_line(line)
+            changed += 1
+            if b'"_data"' in line:
+                referenced.update(attachment.name for part, attachment in newer.parts(loads(line)) if attachment)
+        else:
+            extend(order, OLDER, position)
+    older_attachments = {attachment.name: attachment_identity(attachment) for attachment in older.attachments()}
+    newer_names = set()
+    added = 0
+    for attachment in newer.attachments():
+        newer_names.add(attachment.name)
+        if (attachment.name in referenced
+                or older_attachments.get(attachment.name) != attachment_identity(attachment)):
+            writer.add_attachment(attachment.name, attachment)
+            added += 1
+    removed = [name for name in older_attachments if name not in newer_names]
+    manifest = {'format': FORMAT_VERSION,
+                'older': {'name': older.name, 'messages': older_count, 'digest': older_digest},
+                'messages': count, 'digest': digest.hexdigest(), 'order': order, 'removed_attachments': removed}
+    writer.add_member(MANIFEST, json.dumps(manifest, separators=(',', ':')).encode())
+    return {'messages': count, 'new or changed messages': changed, 'ranges': len(order), 'attachments': added,
+            'removed attachments': len(removed)}
+
+
+class Snapshot:
+    """The lines of a (rebuilt) messages.ndjson, spooled to a temporary file so that ranges of them can be read."""
+
+    def __init__(self, lines, directory):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.offsets = array('Q', [0])
+        digest = hashlib.blake2b()
+        for line in lines:
+            line += b'\n'
+            self.file.write(line)
+            digest.update(line)
+            self.offsets.append(self.offsets[-1] + len(line))
+        self.digest = digest.hexdigest()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lines(self, start, count):
+        self.file.seek(self.offsets[start])
+        for _ in range(count):
+            yield self.file.readline()[:-1]
+
+    def close(self):
+        self.file.close()
+
+
+def apply_delta(snapshot, attachments, delta, directory):
+    """Apply delta (an ExportReader) to snapshot, and to attachments ({name: Attachment}, updated in place),
+    returning the new Snapshot."""
+    if MANIFEST not in delta.zip.NameToInfo:
+        raise ExportError(f'{delta.name} is not a delta (it contains no {MANIFEST})')
+    manifest = json.loads(delta.zip.read(MANIFEST))
+    if manifest['format'] != FORMAT_VERSION:
+        raise ExportError(f'{delta.name} has an unknown format ({manifest["format"]})')
+    if manifest['older']['messages'] != len(snapshot) or manifest['older']['digest'] != snapshot.digest:
+        raise ExportError(f'{delta.name} was made from a different export ({manifest["older"]["name"]})')
+    delta_lines = delta.lines()
+
+    def lines():
+        for source, start, count in manifest['order']:
+            if source == OLDER:
+                yield from snapshot.lines(start, count)
+            else:
+                for _ in range(count):
+                    line = next(delta_lines, None)
+                    if line is None:
+                        raise ExportError(f'{delta.name} has fewer messages than its {MANIFEST} says')
+                    yield line
+
+    rebuilt = Snapshot(lines(), directory)
+    if rebuilt.digest != manifest['digest']:
+        rebuilt.close()
+        raise ExportError(f'The export rebuilt with {delta.name} doesn\'t match the one it was made from')
+    for name in manifest['removed_attachments']:
+        attachments.pop(name, None)
+    for attachment in delta.attachments():
+        attachments[attachment.name] = attachment
+    return rebuilt
+
+
+def apply(base, deltas, writer, directory):
+    """Write the export rebuilt from base and a chain of deltas (ExportReaders) to writer."""
+    snapshot = Snapshot(base.lines(), directory)
+    attachments = {attachment.name: attachment for attachment in base.attachments()}
+    try:
+        for delta in deltas:
+            rebuilt = apply_delta(snapshot, attachments, delta, directory)
+            snapshot.close()
+            snapshot = rebuilt
+            print(f'{delta.name}: {len(snapshot)} messages', file=sys.stderr)
+        for line in snapshot.lines(0, len(snapshot)):
+            writer.write_line(line)
+        for name, attachment in attachments.items():
+            writer.add_attachment(name, attachment)
+    finally:
+        snapshot.close()
+    return {'messages': len(snapshot), 'attachments': len(attachments)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create and apply deltas between SMS Import / Export messages exports.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='write the delta between two exports')
+    create_parser.add_argument('older', help='the older messages-xxx.zip file, possibly encrypted')
+    create_parser.add_argument('newer', help='the newer messages-xxx.zip file, possibly encrypted')
+    create_parser.add_argument('-o', '--output', required=True, help='delta zip file')
+    apply_parser = subparsers.add_parser('apply', help='rebuild an export from an older one and a chain of deltas')
+    apply_parser.add_argument('base', help='the messages-xxx.zip file the first delta was made from')
+    apply_parser.add_argument('deltas', nargs='+', metavar='delta', help='delta zip files, oldest first')
+    apply_parser.add_argument('-o', '--output', required=True, help='rebuilt messages zip file')
+    apply_parser.add_argument('-T', '--temporary-directory',
+                              help='directory for the rebuilt messages.ndjson files (default: the system\'s)')
+    args = parser.parse_args()
+
+    passphrases = {}  # asked for once, and tried on every encrypted input
+
+    def passphrase():
+        if 'passphrase' not in passphrases:
+            passphrases['passphrase'] = getpass('Enter passphrase: ')
+        return passphrases['passphrase']
+
+    input_files = [args.older, args.newer] if args.command == 'create' else [args.base, *args.deltas]
+    readers = []
+    try:
+        for input_file in input_files:
+            reader = ExportReader(input_file, passphrase)
+            readers.append(reader)
+            if reader.kind != 'messages' or reader.format != 'zip':
+                sys.exit(f'{input_file} is not a messages zip file')
+        with ExportWriter(args.output) as writer:
+            if args.command == 'create':
+                stats = create(readers[0], readers[1], writer)
+            else:
+                stats = apply(readers[0], readers[1:], writer, args.temporary_directory)
+    except ExportError as e:
+        sys.exit(str(e))
+    finally:
+        for reader in readers:
+            reader.close()
+    print(', '.join(f'{value} {name}' for name, value in stats.items()), file=sys.stderr)
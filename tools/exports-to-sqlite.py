@@ -0,0 +1,291 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: exports-to-sqlite.py -d exports.db messages-xxx.zip calls-xxx.json contacts-xxx.json ...
+# Loads messages, call log and contacts exports into an SQLite database, for querying, e.g.:
+#     sqlite3 exports.db "SELECT address, count(*) FROM messages GROUP BY address ORDER BY 2 DESC LIMIT 10"
+#
+# Each kind of record has a table with a column for each of the fields most likely to be queried (with numbers stored
+# as integers, MMS dates converted to milliseconds, like SMS ones, and an MMS's address being its sender's, or for sent
+# ones, its recipients'), and the rest of its fields in a JSON object in its extra column (which SQLite's JSON functions
+# can query); MMS parts and addresses, and contacts' raw contacts and their data, are in child tables. Records are read
+# one at a time, and inserted in batches of BATCH_SIZE, each file in a single transaction; indexes are only built once
+# everything is loaded, since keeping them up to date while inserting is much slower.
+#
+# Loading into an existing database appends to it, so exports can be added as they are made: messages and calls that
+# are already in the database (as identified by their date, addresses, type and contents, like merge-exports.py does)
+# are skipped, and contacts replace those with the same lookup key, since each contacts export is a snapshot of all of
+# them.
+
+import argparse
+from getpass import getpass
+import hashlib
+from itertools import chain
+import sqlite3
+import sys
+import time
+
+from sms_ie import ExportError, ExportReader, digits, dumps, member_name, v1_to_v2
+
+BATCH_SIZE = 10000  # rows inserted into a table at a time
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS exports (id INTEGER PRIMARY KEY, file TEXT, kind TEXT, loaded TEXT, records INTEGER,
+    added INTEGER);
+CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, export_id INTEGER, key INTEGER, kind TEXT,
+    thread_id INTEGER, date INTEGER, date_sent INTEGER, address TEXT, display_name TEXT, type INTEGER, read INTEGER,
+    subject TEXT, body TEXT, extra TEXT);
+CREATE TABLE IF NOT EXISTS mms_parts (message_id INTEGER, seq INTEGER, content_type TEXT, name TEXT, text TEXT,
+    data_member TEXT, data_size INTEGER, extra TEXT);
+CREATE TABLE IF NOT EXISTS mms_addresses (message_id INTEGER, type INTEGER, address TEXT, display_name TEXT,
+    extra TEXT);
+CREATE TABLE IF NOT EXISTS calls (id INTEGER PRIMARY KEY, export_id INTEGER, key INTEGER, date INTEGER, number TEXT,
+    display_name TEXT, type INTEGER, duration INTEGER, extra TEXT);
+CREATE TABLE IF NOT EXISTS contacts (id INTEGER PRIMARY KEY, export_id INTEGER, key INTEGER, lookup TEXT,
+    display_name TEXT, starred INTEGER, extra TEXT);
+CREATE TABLE IF NOT EXISTS raw_contacts (id INTEGER PRIMARY KEY, contact_id INTEGER, account_type TEXT,
+    account_name TEXT, extra TEXT);
+CREATE TABLE IF NOT EXISTS contact_data (raw_contact_id INTEGER, contact_id INTEGER, mimetype TEXT, data1 TEXT,
+    extra TEXT);
+'''
+INDEXES = {
+    'messages': ('date', 'address', 'thread_id', 'key'),
+    'mms_parts': ('message_id',),
+    'mms_addresses': ('message_id', 'address'),
+    'calls': ('date', 'number', 'key'),
+    'contacts': ('key',),
+    'raw_contacts': ('contact_id',),
+    'contact_data': ('contact_id', 'mimetype, data1'),
+}
+MMS_OWN_ADDRESS = 'insert-address-token'  # the sender address of MMS sent from the phone
+
+
+def integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def milliseconds(seconds):
+    value = integer(seconds)
+    return value * 1000 if value is not None else None
+
+
+def split(record, fields):
+    """Return the values of fields in record (None for missing ones), and a JSON object of the rest (or None)."""
+    rest = dict(record)
+    values = [rest.pop(field, None) for field in fields]
+    return values, dumps(rest).decode() if rest else None
+
+
+def record_key(*fields):
+    """A record's key: a hash of the fields identifying it, as a signed 64 bit integer, as SQLite stores them."""
+    return int.from_bytes(hashlib.blake2b(dumps(fields), digest_size=8).digest(), 'big', signed=True)
+
+
+class Loader:
+    """Inserts records into the database in batches, assigning the ids that child rows refer to itself, so that they
+    needn't be read back."""
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}  # table -> rows
+        self.next_id = {}
+        for table in ('messages', 'calls', 'contacts', 'raw_contacts'):
+            self.next_id[table] = db.execute(f'SELECT coalesce(max(id), 0) + 1 FROM {table}').fetchone()[0]
+        self.keys = {table: {key for key, in db.execute(f'SELECT key FROM {table}')} for table in ('messages', 'calls')}
+        self.contacts = dict(db.execute('SELECT key, id FROM contacts'))
+
+    def new_id(self, table):
+        self.next_id[table] += 1
+        return self.next_id[table] - 1
+
+    def insert(self, table, row):
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for table in [table] if table else list(self.pending):
+            rows = self.pending.pop(table, None)
+            if rows:
+                self.db.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(rows[0]))})', rows)
+
+    def add_message(self, message, reader, export_id):
+        """Add a message, returning whether it was new."""
+        if 'msg_box' in message or '__parts' in message:
+            return self.add_mms(message, reader, export_id)
+        (thread_id, date, date_sent, address, display_name, sms_type, read, subject, body), extra = split(
+            message, ('thread_id', 'date', 'date_sent', 'address', '__display_name', 'type', 'read', 'subject', 'body'))
+        key = record_key('sms', date, digits(address), sms_type, body)
+        if key in self.keys['messages']:
+            return False
+        self.keys['messages'].add(key)
+        self.insert('messages', (self.new_id('messages'), export_id, key, 'sms', integer(thread_id), integer(date),
+                                 integer(date_sent), address, display_name, integer(sms_type), integer(read), subject,
+                                 body, extra))
+        return True
+
+    def add_mms(self, message, reader, export_id):
+        (thread_id, date, date_sent, msg_box, read, subject, sender, recipients, parts), extra = split(
+            message, ('thread_id', 'date', 'date_sent', 'msg_box', 'read', 'sub', '__sender_address',
+                      '__recipient_addresses', '__parts'))
+        sender, recipients, parts = sender or {}, recipients or [], parts or []
+        key = record_key('mms', date, msg_box, digits(sender.get('address')),
+                         sorted(digits(address.get('address')) for address in recipients),
+                         [[part.get('ct'), part.get('text')] for part in parts])
+        if key in self.keys['messages']:
+            return False
+        self.keys['messages'].add(key)
+        message_id = self.new_id('messages')
+        body = '\n'.join(part['text'] for part in parts if part.get('ct') == 'text/plain' and part.get('text'))
+        correspondents = [sender] if sender.get('address') != MMS_OWN_ADDRESS else recipients
+        address = ', '.join(filter(None, (correspondent.get('address') for correspondent in correspondents)))
+        name = ', '.join(filter(None, (correspondent.get('__display_name') for correspondent in correspondents)))
+        self.insert('messages', (message_id, export_id, key, 'mms', integer(thread_id), milliseconds(date),
+                                 milliseconds(date_sent), address or None, name or None, integer(msg_box),
+                                 integer(read), subject, body or None, extra))
+        for mms_address in chain([sender] if sender else [], recipients):
+            (address_type, address, display_name), address_extra = split(
+                mms_address, ('type', 'address', '__display_name'))
+            self.insert('mms_addresses', (message_id, integer(address_type), address, display_name, address_extra))
+        for part in parts:
+            (seq, content_type, name, text), part_extra = split(part, ('seq', 'ct', 'name', 'text'))
+            attachment = reader.attachment(part)
+            self.insert('mms_parts', (message_id, integer(seq), content_type, name, text,
+                                      member_name(part) if '_data' in part else None,
+                                      attachment.size if attachment else None, part_extra))
+        return True
+
+    def add_call(self, call, export_id):
+        (date, number, display_name, call_type, duration), extra = split(
+            call, ('date', 'number', 'display_name', 'type', 'duration'))
+        key = record_key(date, digits(number), call_type, duration)
+        if key in self.keys['calls']:
+            return False
+        self.keys['calls'].add(key)
+        self.insert('calls', (self.new_id('calls'), export_id, key, integer(date), number, display_name,
+                              integer(call_type), integer(duration), extra))
+        return True
+
+    def add_contact(self, contact, export_id):
+        """Add a contact, replacing any with the same lookup key, returning whether it was new."""
+        (lookup, display_name, starred, raw_contacts), extra = split(
+            contact, ('lookup', 'display_name', 'starred', 'raw_contacts'))
+        key = record_key(lookup or [contact.get('_id'), display_name])
+        replaced = self.contacts.get(key)
+        if replaced is not None:
+            self.flush()  # the contact may not have been written yet, if it was in the same file
+            for table, column in (('contacts', 'id'), ('raw_contacts', 'contact_id'), ('contact_data', 'contact_id')):
+                self.db.execute(f'DELETE FROM {table} WHERE {column} = ?', (replaced,))
+        contact_id = self.contacts[key] = self.new_id('contacts')
+        self.insert('contacts', (contact_id, export_id, key, lookup, display_name, integer(starred), extra))
+        for raw_contact in raw_contacts or ():
+            (account_type, account_name, data), raw_extra = split(
+                raw_contact, ('account_type', 'account_name', 'contacts_data'))
+            raw_contact_id = self.new_id('raw_contacts')
+            self.insert('raw_contacts', (raw_contact_id, contact_id, account_type, account_name, raw_extra))
+            for datum in data or ():
+                (mimetype, data1), data_extra = split(datum, ('mimetype', 'data1'))
+                self.insert('contact_data', (raw_contact_id, contact_id, mimetype, data1, data_extra))
+        return replaced is None
+
+
+def record_kind(reader, records):
+    """Return the kind of records reader has, and the records, telling calls, contacts and (v1) messages apart by the
+    first record if the file's name doesn't say."""
+    if reader.kind:
+        return reader.kind, records
+    first = next(records, None)
+    if first is None:
+        return None, iter(())
+    kind = 'contacts' if 'raw_contacts' in first else 'calls' if 'duration' in first else 'messages'
+    return kind, chain([first], records)
+
+
+def load(db, loader, reader):
+    """Load the records from reader (in a single transaction), returning (kind, records, new records)."""
+    kind, records = record_kind(reader, iter(reader))
+    if kind not in ('messages', 'calls', 'contacts'):
+        raise ExportError(f'{reader.name} is a {kind} export, which can\'t be loaded')
+    v1 = kind == 'messages' and reader.format == 'array'
+    count = added = 0
+    with db:
+        export_id = db.execute('INSERT INTO exports (file, kind, loaded) VALUES (?, ?, ?)',
+                               (reader.name, kind, time.strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+        for count, record in enumerate(records, 1):
+            if kind == 'messages':
+                added += loader.add_message(v1_to_v2(record) if v1 else record, reader, export_id)
+            elif kind == 'calls':
+                added += loader.add_call(record, export_id)
+            else:
+                added += loader.add_contact(record, export_id)
+        loader.flush()
+        db.execute('UPDATE exports SET records = ?, added = ? WHERE id = ?', (count, added, export_id))
+    return kind, count, added
+
+
+def create_indexes(db):
+    with db:
+        for table, columns in INDEXES.items():
+            for column in columns:
+                db.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column.replace(", ", "_")} ON {table} ({column})')
+        db.execute('ANALYZE')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load SMS Import / Export exports into an SQLite database.')
+    parser.add_argument('input_files', nargs='+', metavar='input_file',
+                        help='messages-xxx.zip, calls-xxx.json or contacts-xxx.json files (or v1 messages-xxx.json, '
+                             'or bare messages.ndjson files), possibly encrypted')
+    parser.add_argument('-d', '--database', required=True,
+                        help='SQLite database file, created if it doesn\'t exist, and appended to if it does')
+    args = parser.parse_args()
+
+    passphrases = {}  # asked for once, and tried on every encrypted input
+
+    def passphrase():
+        if 'passphrase' not in passphrases:
+            passphrases['passphrase'] = getpass('Enter passphrase: ')
+        return passphrases['passphrase']
+
+    db = sqlite3.connect(args.database)
+    try:
+        # Durability isn't needed while loading: an interrupted file's transaction is rolled back when the database is
+        # next opened, and if the system crashes, the database can be loaded again
+        db.execute('PRAGMA synchronous = OFF')
+        db.execute('PRAGMA cache_size = -262144')  # 256 MiB
+        db.execute('PRAGMA temp_store = MEMORY')
+        db.executescript(SCHEMA)
+        loader = Loader(db)
+        start = time.perf_counter()
+        for input_file in args.input_files:
+            try:
+                with ExportReader(input_file, passphrase) as reader:
+                    kind, count, added = load(db, loader, reader)
+            except ExportError as e:
+                sys.exit(str(e))
+            print(f'{input_file}: {count} {kind} records, {added} new', file=sys.stderr)
+        print('Building indexes', file=sys.stderr)
+        create_indexes(db)
+        print(f'Done in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+    finally:
+        db.close()
@@ -0,0 +1,290 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: generate-export.py [-n MESSAGES] [--attachment-size BYTES] [-f {zip,v1,csv,silence}] [-o OUTPUT] ...
+# Writes a synthetic collection of messages, for testing and benchmarking the tools: by default, a v2 messages zip file
+# like the app's (SMS, then MMS with parts and addresses, then the MMS attachments), or the same messages in v1 format,
+# or (SMS only) in CSV or Silence XML format. The output is determined by the options and the seed, so that benchmarks
+# run on different machines or at different times use the same data. Attachments are random bytes, generated as they
+# are written, so the output can be much larger than memory.
+
+import argparse
+import base64
+import csv
+import json
+import math
+import random
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+from sms_ie import ExportWriter, member_name
+
+WORDS = ('the', 'be', 'to', 'of', 'and', 'a', 'in', 'that', 'have', 'I', 'it', 'for', 'not', 'on', 'with', 'he', 'as',
+         'you', 'do', 'at', 'this', 'but', 'his', 'by', 'from', 'they', 'we', 'say', 'her', 'she', 'or', 'an', 'will',
+         'my', 'one', 'all', 'would', 'there', 'their', 'what', 'so', 'up', 'out', 'if', 'about', 'who', 'get', 'which',
+         'go', 'me', 'when', 'make', 'can', 'like', 'time', 'no', 'just', 'him', 'know', 'take', 'people', 'ok', 'thanks',
+         'tomorrow', 'tonight', 'home', 'call', 'later', 'see', 'lol', 'sure', 'sorry', 'running', 'late', 'love')
+EMOJI = ('\U0001F600', '\U0001F602', '\U0001F44D', '❤️', '\U0001F389', '\U0001F64F')
+FIRST_NAMES = ('Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn', 'Drew', 'Robin')
+LAST_NAMES = ('Smith', 'Cohen', 'Garcia', 'Nguyen', 'Patel', 'Kim', 'Müller', 'Rossi', 'Silva', 'Novak', 'Levi', 'Ito')
+MEDIA_TYPES = (('image/jpeg', 'jpg', 0.7), ('image/png', 'png', 0.1), ('video/mp4', 'mp4', 0.1), ('audio/amr', 'amr', 0.1))
+OWN_ADDRESS = '+15550000000'
+START_DATE = 1262304000000  # 2010-01-01, in milliseconds since the epoch, as Android stores dates
+DATE_SPAN = 15 * 365 * 86400 * 1000
+ZIP_DATE_TIME = (2025, 1, 1, 0, 0, 0)  # for the zip members, so that the output doesn't depend on when it was written
+PARTS_DIRECTORY = '/data/user_de/0/com.android.providers.telephony/app_parts/'
+SMS_COLUMNS = ('_id', 'thread_id', 'address', 'date', 'date_sent', 'protocol', 'read', 'status', 'type',
+               'reply_path_present', 'body', 'service_center', 'locked', 'sub_id', 'error_code', 'creator', 'seen')
+FORMATS = {'zip': 'zip', 'v1': 'json', 'csv': 'csv', 'silence': 'xml'}  # and their file name extensions
+
+
+class Generator:
+    """The synthetic messages, generated in the order the app exports them: all the SMS, then all the MMS."""
+
+    def __init__(self, messages, mms_fraction=0.1, correspondents=500, named_fraction=0.7, attachment_size=100000,
+                 attachment_distribution='lognormal', max_attachment_size=16 << 20, seed=0):
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.mms = round(messages * mms_fraction)
+        self.sms = messages - self.mms
+        self.attachment_size = attachment_size
+        self.attachment_distribution = attachment_distribution
+        self.max_attachment_size = max_attachment_size
+        self.correspondents = []  # (address, display name or None)
+        for i in range(max(1, correspondents)):
+            name = f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}' \
+                if self.random.random() < named_fraction else None
+            self.correspondents.append((f'+1555{1000000 + i:07d}', name))
+        self.attachments = 0
+        self.attachment_bytes = 0
+
+    def body(self, words=None):
+        words = self.random.choices(WORDS, k=words or max(1, int(self.random.expovariate(1 / 12))))
+        if self.random.random() < 0.1:
+            words.append(self.random.choice(EMOJI))
+        return ' '.join(words).capitalize()
+
+    def attachment_length(self):
+        mean = self.attachment_size
+        if self.attachment_distribution == 'fixed':
+            length = mean
+        elif self.attachment_distribution == 'uniform':
+            length = self.random.uniform(0, 2 * mean)
+        elif self.attachment_distribution == 'exponential':
+            length = self.random.expovariate(1 / mean)
+        else:  # lognormal, with the given mean: most attachments are small, and a few are very large
+            sigma = 1.0
+            length = self.random.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+        return max(1, min(int(length), self.max_attachment_size))
+
+    def date(self, i, n):
+        """Dates increase through each of the SMS and the MMS, spread over DATE_SPAN."""
+        return START_DATE + int((i + self.random.random()) * DATE_SPAN / n)
+
+    def sms_message(self, i):
+        thread = self.random.randrange(len(self.correspondents))
+        address, name = self.correspondents[thread]
+        date = self.date(i, self.sms)
+        received = self.random.random() < 0.55
+        message = {'_id': str(i + 1), 'thread_id': str(thread + 1), 'address': address, 'date': str(date),
+                   'date_sent': str(date - self.random.randrange(5000)) if received else '0', 'protocol': '0',
+                   'read': '1', 'status': '-1', 'type': '1' if received else '2', 'reply_path_present': '0',
+                   'body': self.body(), 'locked': '0', 'sub_id': '1', 'error_code': '0',
+                   'creator': 'com.google.android.apps.messaging', 'seen': '1'}
+        if received:
+            message['service_center'] = '+15559999999'
+        if name:
+            message['__display_name'] = name
+        return message
+
+    def address(self, message_id, address, address_type, name):
+        record = {'_id': str(self.random.randrange(1, 1 << 24)), 'msg_id': message_id,
+                  'address': address, 'type': address_type, 'charset': '106'}
+        if name:
+            record['__display_name'] = name
+        return record
+
+    def mms_message(self, i):
+        """Return an MMS message, and its attachments as (member name, length) pairs."""
+        message_id = str(i + 1)
+        date = self.date(i, self.mms)
+        received = self.random.random() < 0.55
+        group = self.random.random() < 0.1
+        thread = self.random.randrange(len(self.correspondents))
+        members = self.random.sample(self.correspondents, min(len(self.correspondents), self.random.randint(2, 5))) \
+            if group else [self.correspondents[thread]]
+        sender = self.random.choice(members) if received else ('insert-address-token', None)
+        recipients = [member for member in members if member is not sender] + ([(OWN_ADDRESS, None)] if received else [])
+        message = {'_id': message_id,
+                   'thread_id': str(len(self.correspondents) + 1 + thread if group else thread + 1),
+                   'date': str(date // 1000), 'date_sent': str(date // 1000) if received else '0',
+                   'msg_box': '1' if received else '2', 'read': '1', 'm_id': f'{date:x}{i:x}@mms.example.com',
+                   'ct_t': 'application/vnd.wap.multipart.related', 'm_type': '132' if received else '128',
+                   'v': '18', 'pri': '129', 'rr': '129', 'tr_id': f'T{date:x}{i:x}', 'd_rpt': '129', 'locked': '0',
+                   'sub_id': '1', 'seen': '1', 'creator': 'com.google.android.apps.messaging', 'text_only': '0',
+                   '__sender_address': self.address(message_id, sender[0], '137', sender[1]),
+                   '__recipient_addresses': [self.address(message_id, address, '151', name)
+                                             for address, name in recipients]}
+        part_id = i * 4
+        parts = [{'_id': str(part_id + 1), 'mid': message_id, 'seq': '-1', 'ct': 'application/smil', 'cid': '<smil>',
+                  'cl': 'smil.xml', 'text': '<smil><head><layout/></head><body><par dur="5000ms"/></body></smil>'}]
+        attachments = []
+        for k in range(self.random.choices((0, 1, 2), (0.15, 0.75, 0.1))[0]):
+            content_type, extension = self.random.choices([m[:2] for m in MEDIA_TYPES], [m[2] for m in MEDIA_TYPES])[0]
+            file_name = f'IMG_{part_id + 2 + k}.{extension}'
+            part = {'_id': str(part_id + 2 + k), 'mid': message_id, 'seq': '0', 'ct': content_type,
+                    'name': file_name, 'cid': f'<{file_name}>', 'cl': file_name,
+                    '_data': f'{PARTS_DIRECTORY}PART_{date}{part_id + 2 + k}_{file_name}'}
+            parts.append(part)
+            attachments.append((member_name(part), self.attachment_length()))
+        if not attachments or self.random.random() < 0.5:
+            parts.append({'_id': str(part_id + 4), 'mid': message_id, 'seq': '0', 'ct': 'text/plain', 'chset': '106',
+                          'cid': '<text_0.txt>', 'cl': 'text_0.txt', 'text': self.body()})
+        message['__parts'] = parts
+        message['m_size'] = str(sum(length for _, length in attachments) + 200)
+        self.attachments += len(attachments)
+        self.attachment_bytes += sum(length for _, length in attachments)
+        return message, attachments
+
+    def messages(self, include_mms=True):
+        """Yield (message, attachments) for each message."""
+        for i in range(self.sms):
+            yield self.sms_message(i), []
+        if include_mms:
+            for i in range(self.mms):
+                yield self.mms_message(i)
+
+    def attachment_data(self, name, length):
+        """The attachment's contents, which depend only on the seed and its name, so they can be generated in any
+        order."""
+        return random.Random(f'{self.seed}/{name}').randbytes(length)
+
+
+def write_zip(generator, output_file, stored):
+    """v2 format. The messages are serialized with the json module, so the output doesn't depend on whether orjson is
+    installed."""
+    with ExportWriter(output_file, date_time=ZIP_DATE_TIME,
+                      attachment_compression=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED) as writer:
+        for message, attachments in generator.messages():
+            writer.write_line(json.dumps(message).encode())
+            for name, length in attachments:
+                writer.add_attachment(name, lambda name=name, length=length: generator.attachment_data(name, length))
+
+
+def v1_message(message, attachments, generator):
+    """The message as it was exported before version 2.0.0: without the '__' prefixes, and with the attachments'
+    contents base64 encoded in their parts."""
+    converted = {}
+    for k, v in message.items():
+        k = k.removeprefix('__')
+        if k == 'parts':
+            lengths = dict(attachments)
+            v = [dict(part, binary_data=base64.b64encode(generator.attachment_data(member_name(part),
+                                                                                  lengths[member_name(part)])).decode())
+                 if '_data' in part else part for part in v]
+        elif k == 'sender_address':
+            v = {key.removeprefix('__'): value for key, value in v.items()}
+        elif k == 'recipient_addresses':
+            v = [{key.removeprefix('__'): value for key, value in address.items()} for address in v]
+        converted[k] = v
+    return converted
+
+
+def write_v1(generator, output_file):
+    with open(output_file, 'w') as f:
+        f.write('[')
+        separator = '\n'
+        for message, attachments in generator.messages():
+            f.write(separator + json.dumps(v1_message(message, attachments, generator)))
+            separator = ',\n'
+        f.write('\n]\n' if separator != '\n' else ']\n')
+
+
+def write_csv(generator, output_file):
+    """SMS only, with the columns used by Android."""
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, SMS_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for message, _ in generator.messages(include_mms=False):
+            writer.writerow(message)
+
+
+def silence_escape(text):
+    """Escape an attribute value as Silence does, including its invalid encoding of characters outside the Basic
+    Multilingual Plane as a pair of UTF-16 surrogate entities (which silence-xml-fixer.py fixes)."""
+    text = escape(text, {'"': '&quot;', '\n': '&#10;'})
+    return ''.join(c if ord(c) < 0x10000 else
+                   f'&#{0xD800 + ((ord(c) - 0x10000) >> 10)};&#{0xDC00 + ((ord(c) - 0x10000) & 0x3FF)};' for c in text)
+
+
+def write_silence(generator, output_file):
+    """SMS only, in the format Silence exports (which is that of SMS Backup & Restore)."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(f"<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>\n<smses count=\"{generator.sms}\">\n")
+        for message, _ in generator.messages(include_mms=False):
+            attributes = {'protocol': '0', 'address': message['address'], 'date': message['date'],
+                          'type': message['type'], 'subject': 'null', 'body': message['body'], 'toa': '0',
+                          'sc_toa': '0', 'service_center': message.get('service_center', 'null'), 'read': '1',
+                          'status': '-1', 'locked': '0'}
+            f.write('  <sms ' + ' '.join(f'{k}="{silence_escape(v)}"' for k, v in attributes.items()) + ' />\n')
+        f.write('</smses>\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic collection of messages, for testing and '
+                                                 'benchmarking.')
+    parser.add_argument('-n', '--messages', type=int, default=10000, help='number of messages (default: %(default)s)')
+    parser.add_argument('--mms-fraction', type=float, default=0.1,
+                        help='fraction of the messages that are MMS (default: %(default)s)')
+    parser.add_argument('--correspondents', type=int, default=500,
+                        help='number of people messages are exchanged with (default: %(default)s)')
+    parser.add_argument('--named-fraction', type=float, default=0.7,
+                        help='fraction of the correspondents who have a display name (default: %(default)s)')
+    parser.add_argument('--attachment-size', type=int, default=100000,
+                        help='mean attachment size in bytes (default: %(default)s)')
+    parser.add_argument('--attachment-distribution', choices=('fixed', 'uniform', 'exponential', 'lognormal'),
+                        default='lognormal', help='distribution of attachment sizes (default: %(default)s)')
+    parser.add_argument('--max-attachment-size', type=int, default=16 << 20,
+                        help='maximum attachment size in bytes (default: %(default)s)')
+    parser.add_argument('--stored', action='store_true',
+                        help='store the attachments in the zip file uncompressed (faster, since random data does not '
+                             'compress; the app itself deflates them)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='zip',
+                        help="output format: a v2 zip file (the default), v1 JSON, or, for the SMS only, CSV or "
+                             "Silence XML")
+    parser.add_argument('-o', '--output', help='output file (default: messages-synthetic.<zip|json|csv|xml>)')
+    args = parser.parse_args()
+
+    generator = Generator(args.messages, args.mms_fraction, args.correspondents, args.named_fraction,
+                          args.attachment_size, args.attachment_distribution, args.max_attachment_size, args.seed)
+    output_file = args.output or f'messages-synthetic.{FORMATS[args.format]}'
+    if args.format == 'zip':
+        write_zip(generator, output_file, args.stored)
+    elif args.format == 'v1':
+        write_v1(generator, output_file)
+    elif args.format == 'csv':
+        write_csv(generator, output_file)
+    else:
+        write_silence(generator, output_file)
+    included_mms = generator.mms if args.format in ('zip', 'v1') else 0
+    print(f'{output_file}: {generator.sms} SMS, {included_mms} MMS, {generator.attachments} attachments '
+          f'({generator.attachment_bytes / 1e6:.1f} MB)', file=sys.stderr)
@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: merge-exports.py -o merged.zip messages-1.zip messages-2.zip ...
+# Merges messages exports into one, ordered by date, leaving out duplicate messages. Each input is read once, and its
+# messages are sorted by date (and fingerprint) in runs of RUN_SIZE, which are spooled to temporary files and then
+# merged, so memory use doesn't depend on the size of the inputs. Since duplicates have the same date and fingerprint,
+# they are adjacent in the merged runs, and are dropped as they are met.
+#
+# A message's fingerprint is a hash of the fields identifying it: for SMS, the date, address, type and body; for MMS,
+# the date, box, addresses, and the content type and text or binary data (as identified by the CRC and size recorded in
+# the zip file, so it isn't read) of each part. Attachments are copied without being decompressed. The app matches
+# attachments to parts by file name, so an attachment that is in several inputs (with the same name, CRC and size) is
+# only stored once, and one that shares its name with a different attachment is renamed (and its part's _data changed
+# to match). Identical data under different names is stored under each of them, since the app gives each file to only
+# one part.
+
+import argparse
+from getpass import getpass
+import hashlib
+import heapq
+import json
+import os
+import sys
+import tempfile
+
+from sms_ie import ExportError, ExportReader, ExportWriter, digits, dumps, loads
+
+RUN_SIZE = 200000  # messages sorted in memory at a time
+
+
+def attachment_identity(attachment):
+    return [attachment.info.CRC, attachment.size] if attachment else None
+
+
+def sort_key(message, reader):
+    """Return (date in milliseconds, fingerprint) for a message from reader."""
+    if 'msg_box' in message or '__parts' in message:  # MMS, whose dates are in seconds
+        date = int(message.get('date') or 0) * 1000
+        identity = ['mms', date, message.get('msg_box'), digits(message.get('__sender_address', {}).get('address')),
+                    sorted(digits(address.get('address')) for address in message.get('__recipient_addresses', ())),
+                    [[part.get('ct'), part.get('text'), attachment_identity(attachment)]
+                     for part, attachment in reader.parts(message)]]
+    else:
+        date = int(message.get('date') or 0)
+        identity = ['sms', date, digits(message.get('address')), message.get('type'), message.get('body')]
+    fingerprint = hashlib.blake2b(json.dumps(identity).encode(), digest_size=16).hexdigest()
+    return date, fingerprint
+
+
+def write_run(lines, directory):
+    """Sort and spool a run of (key, source, line) tuples, returning the file, positioned at its start."""
+    lines.sort(key=lambda line: line[0])
+    run = tempfile.TemporaryFile(dir=directory)
+    for (date, fingerprint), source, line in lines:
+        run.write(b'%020d %s %d %s\n' % (date, fingerprint.encode(), source, line))
+    run.seek(0)
+    lines.clear()
+    return run
+
+
+def read_run(run):
+    for record in run:
+        date, fingerprint, source, line = record.split(b' ', 3)
+        yield (int(date), fingerprint.decode()), int(source), line.rstrip(b'\n')
+
+
+def sorted_runs(readers, directory, run_size):
+    """Read every message from the readers, returning sorted runs of (key, source, line)."""
+    runs = []
+    lines = []
+    for source, reader in enumerate(readers):
+        count = 0
+        for line in reader.lines():
+            lines.append((sort_key(loads(line), reader), source, line))
+            count += 1
+            if len(lines) >= run_size:
+                runs.append(write_run(lines, directory))
+        print(f'{reader.name}: {count} messages', file=sys.stderr)
+    if lines:
+        runs.append(write_run(lines, directory))
+    return runs
+
+
+def unique_name(name, names):
+    stem, extension = os.path.splitext(name)
+    n = 1
+    while f'{stem}-{n}{extension}' in names:
+        n += 1
+    return f'{stem}-{n}{extension}'
+
+
+def merge(readers, writer, directory, run_size=RUN_SIZE):
+    """Merge the messages from the readers into the writer, returning a dictionary of statistics."""
+    runs = sorted_runs(readers, directory, run_size)
+    stats = dict.fromkeys(('messages', 'duplicates', 'attachments', 'shared attachments', 'renamed attachments'), 0)
+    stored = {}  # member name -> identity of the attachment stored under that name
+    previous = None
+    try:
+        for key, source, line in heapq.merge(*(read_run(run) for run in runs), key=lambda record: record[0]):
+            if key == previous:
+                stats['duplicates'] += 1
+                continue
+            previous = key
+            stats['messages'] += 1
+            if b'"_data"' not in line:  # no attachments, so the line can be copied as it is
+                writer.write_line(line)
+                continue
+            reader = readers[source]
+            message = loads(line)
+            changed = False
+            for part, attachment in reader.parts(message):
+                if attachment is None:
+                    continue
+                name, identity = attachment.name, attachment_identity(attachment)
+                if stored.get(name) == identity:
+                    stats['shared attachments'] += 1
+                    continue
+                if name in stored:  # a different attachment with the same name
+                    name = unique_name(name, stored)
+                    old_file_name = attachment.name.removeprefix('data/')
+                    part['_data'] = part['_data'][:-len(old_file_name)] + name.removeprefix('data/')
+                    changed = True
+                    stats['renamed attachments'] += 1
+                stored[name] = identity
+                writer.add_attachment(name, attachment)
+                stats['attachments'] += 1
+            writer.write_line(dumps(message) if changed else line)
+    finally:
+        for run in runs:
+            run.close()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge SMS Import / Export messages exports, leaving out duplicates.')
+    parser.add_argument('input_files', nargs='+', metavar='input_file',
+                        help='messages-xxx.zip (or .ndjson) files, possibly encrypted (v1 exports must be converted '
+                             'first)')
+    parser.add_argument('-o', '--output', required=True, help='merged messages zip file')
+    parser.add_argument('-r', '--run-size', type=int, default=RUN_SIZE,
+                        help='messages sorted in memory at a time (default: %(default)s)')
+    parser.add_argument('-T', '--temporary-directory', help='directory for the sorted runs (default: the system\'s)')
+    args = parser.parse_args()
+
+    passphrases = {}  # asked for once, and tried on every encrypted input
+
+    def passphrase():
+        if 'passphrase' not in passphrases:
+            passphrases['passphrase'] = getpass('Enter passphrase: ')
+        return passphrases['passphrase']
+
+    readers = []
+    try:
+        for input_file in args.input_files:
+            reader = ExportReader(input_file, passphrase)
+            readers.append(reader)
+            if reader.kind != 'messages':
+                sys.exit(f'{input_file} is not a messages export')
+            if reader.format == 'array':
+                sys.exit(f'{input_file} is a v1 export; convert it with v1-v2-convert.py first')
+        with ExportWriter(args.output) as writer:
+            stats = merge(readers, writer, args.temporary_directory, args.run_size)
+    except ExportError as e:
+        sys.exit(str(e))
+    finally:
+        for reader in readers:
+            reader.close()
+    print(', '.join(f'{value} {name}' for name, value in stats.items()), file=sys.stderr)
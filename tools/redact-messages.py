@@ -18,29 +18,42 @@
 # You should have received a copy of the GNU General Public License
 # along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
 
-import sys
-import json
+# Usage: redact-messages.py < messages.ndjson > messages-redacted.ndjson
+#        redact-messages.py [-o messages-redacted.zip] [-a {strip,replace,keep}] [-j JOBS] messages-xxx.zip
+# Messages are redacted in batches by a pool of worker processes. Workers can't share the address map, so each one
+# replaces every address with its index in a list of the batch's addresses, and the main process, which sees the
+# batches in order, numbers the addresses and substitutes them into the serialized batch. Input files are opened with
+# the sms_ie package, which recognizes zip, NDJSON and encrypted files.
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from getpass import getpass
 from itertools import count
+import json
+import os
+import re
+import sys
+
+from sms_ie import ExportError, ExportReader, ExportWriter
 
 address_iterator = count(start=12345)
 address_map = {}
 redacted_fields = {'body', '__display_name', 'text', 'sub'}
 REDACTED = 'REDACTED '
+BATCH_SIZE = 2000  # messages redacted by a worker at a time
+# json.dumps() escapes quotes within strings, so this only matches "address" keys, whose values are batch indices
+ADDRESS_PLACEHOLDER = re.compile(rb'"address": (\d+)')
 
 
-def redact(obj):
+def redact(obj, addresses):
     for x in obj:
         if isinstance(x, dict):
-            redact(x)
+            redact(x, addresses)
         elif isinstance(obj[x], list) or isinstance(obj[x], dict):
-            redact(obj[x])
+            redact(obj[x], addresses)
         elif x == 'address':
-            if obj[x] in address_map:
-                obj[x] = address_map[obj[x]]
-            else:
-                old_address = obj[x]
-                obj[x] = str(next(address_iterator))
-                address_map[old_address] = obj[x]
+            obj[x] = addresses.setdefault(obj[x], len(addresses))
         elif x == 'body':
             obj[x] = REDACTED + '(Message ID: ' + obj['_id'] + ')'
         elif x == 'text':
@@ -49,7 +62,95 @@ def redact(obj):
             obj[x] = REDACTED
 
 
-for message in sys.stdin:
-    message = json.loads(message)
-    redact(message)
-    print(json.dumps(message))
+def redact_batch(lines):
+    """Redact a batch of NDJSON lines, returning the redacted NDJSON with each address replaced by a placeholder, and
+    the batch's addresses in order of first appearance."""
+    addresses = {}
+    output = []
+    for line in lines:
+        message = json.loads(line)
+        redact(message, addresses)
+        output.append(json.dumps(message) + '\n')
+    return ''.join(output).encode(), list(addresses)
+
+
+def fill_addresses(text, addresses):
+    """Substitute the redacted addresses for the placeholders in a batch redacted by redact_batch()."""
+    numbers = []
+    for address in addresses:
+        if address not in address_map:
+            address_map[address] = str(next(address_iterator))
+        numbers.append(b'"address": "' + address_map[address].encode() + b'"')
+    return ADDRESS_PLACEHOLDER.sub(lambda m: numbers[int(m[1])], text)
+
+
+def batches(lines):
+    batch = []
+    for line in lines:
+        if line.strip():
+            batch.append(line)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def redact_stream(lines, write, jobs):
+    """Redact NDJSON lines, passing the redacted NDJSON (bytes) to write(), with up to jobs worker processes."""
+    if jobs == 1:
+        for batch in batches(lines):
+            write(fill_addresses(*redact_batch(batch)))
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()  # bounded, so that the input is read no faster than it is redacted
+        for batch in batches(lines):
+            pending.append(executor.submit(redact_batch, batch))
+            if len(pending) == 2 * jobs:
+                write(fill_addresses(*pending.popleft().result()))
+        while pending:
+            write(fill_addresses(*pending.popleft().result()))
+
+
+def redact_zip(reader, output_file, attachments, jobs):
+    with ExportWriter(output_file) as writer:
+        redact_stream(reader.lines(), writer.write_ndjson, jobs)
+        for attachment in reader.attachments():
+            if attachments == 'keep':
+                writer.add_attachment(attachment.name, attachment)
+            elif attachments == 'replace':
+                writer.add_attachment(attachment.name, f'{REDACTED}(Attachment: {attachment.name})'.encode())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Redact a collection of messages in SMS Import / Export NDJSON format, or a messages-xxx.zip export.')
+    parser.add_argument('input_file', nargs='?',
+                        help='messages.ndjson or messages-xxx.zip file to redact, possibly encrypted (.ssef) '
+                             '(default: NDJSON on standard input)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: <input_file>-redacted.zip for a zip file, else standard output; '
+                             'required for a zip file on standard input)')
+    parser.add_argument('-a', '--attachments', choices=('strip', 'replace', 'keep'), default='strip',
+                        help="for zip files, leave out attachments ('strip', the default), replace their contents with a "
+                             "placeholder ('replace'), or copy them unredacted ('keep')")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: %(default)s)')
+    args = parser.parse_args()
+
+    try:
+        reader = ExportReader(args.input_file or sys.stdin.buffer, lambda: getpass('Enter passphrase: '))
+    except ExportError as e:
+        sys.exit(str(e))
+    with reader:
+        if reader.zip:
+            if args.output:
+                output_file = args.output
+            elif args.input_file:
+                output_file = os.path.splitext(args.input_file.removesuffix('.ssef'))[0] + '-redacted.zip'
+            else:
+                sys.exit('A zip file on standard input requires -o')
+            redact_zip(reader, output_file, args.attachments, args.jobs)
+        else:
+            with open(args.output, 'wb') if args.output else sys.stdout.buffer as output:
+                redact_stream(reader.lines(), output.write, args.jobs)
@@ -23,31 +23,40 @@
 # This utility converts message in Silence (https://silence.im/) XML format to SMS I/E 'v2' format
 # Usage: 'silence-convert.py <silence-xxx.xml>'
 # This will read messages from <silence-xxx.xml> and write them to <silence-xxx.zip>.
+# The XML is fixed with silence-xml-fixer.py's fix_chunks() and parsed as it is read, and each message is written
+# out and discarded as soon as it has been parsed, so there is no need to run the fixer first, and memory use does not
+# depend on the size of the input.
 
 
 import sys
-import json
 import xml.etree.ElementTree as ET
-import zipfile
 import os
+from functools import partial
+from importlib.util import module_from_spec, spec_from_file_location
 
+from sms_ie import ExportWriter
 
-def copy_convert(json_old):
-    json_new = {}
-    for k, v in json_old.items():
-        if k != 'binary_data':
-            new_k = '__' + k if k in custom_names else k
-            new_v = [copy_convert(x) for x in v] if isinstance(v, list) else copy_convert(v) if isinstance(v, dict) else v
-            json_new[new_k] = new_v
-    return json_new
+# silence-xml-fixer.py's name isn't a valid module name, so it has to be loaded by path
+fixer_spec = spec_from_file_location('silence_xml_fixer', os.path.join(os.path.dirname(__file__), 'silence-xml-fixer.py'))
+silence_xml_fixer = module_from_spec(fixer_spec)
+fixer_spec.loader.exec_module(silence_xml_fixer)
 
 
 input_file = sys.argv[1]
-tree = ET.parse(input_file)
-smses = tree.getroot()
-messages_ndjson = []
 output_file = input_file[:-3] + 'zip' if input_file[-3:] == 'xml' else input_file + 'zip'
-with (zipfile.ZipFile(output_file, mode='w') as messages_zip):
-    for sms in smses:
-        messages_ndjson.append(json.dumps(dict(sms.items())) + '\n')
-    messages_zip.writestr('messages.ndjson', ''.join(messages_ndjson))
+parser = ET.XMLPullParser(('start', 'end'))
+depth = 0
+with open(input_file, 'rb') as xml_file, ExportWriter(output_file) as messages_zip:
+    for chunk in silence_xml_fixer.fix_chunks(iter(partial(xml_file.read, silence_xml_fixer.CHUNK_SIZE), b'')):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                if depth == 0:
+                    smses = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                messages_zip.write(dict(element.items()))
+                smses.remove(element)
+    parser.close()
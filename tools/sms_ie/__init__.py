@@ -0,0 +1,38 @@
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Reading and writing the files exported by SMS I/E, for the tools in this directory: messages (and blocked numbers)
+# zip files, bare NDJSON files, call log and contacts JSON files, and v1 messages JSON files, any of which may be
+# encrypted (which requires ssef.py, in the directory above, and PyNaCl). Records are read and written one at a time, so
+# memory use does not depend on the size of the file, and MMS attachments are only read when asked for. orjson is used
+# for parsing and serialization if it is installed.
+#
+#     with ExportReader('messages-xxx.zip') as export, ExportWriter('messages-yyy.zip') as output:
+#         for message in export:
+#             output.write(message)
+#             for part, attachment in export.parts(message):
+#                 if attachment:
+#                     output.add_attachment(attachment.name, attachment)  # copied without recompression
+
+from .fastjson import HAVE_ORJSON, dumps, loads
+from .formats import ARRAY_KINDS, NDJSON_MEMBERS, digits, member_name, v1_to_v2
+from .reader import Attachment, ExportError, ExportReader
+from .writer import ExportWriter, copy_member
+
+__all__ = ['HAVE_ORJSON', 'dumps', 'loads', 'ARRAY_KINDS', 'NDJSON_MEMBERS', 'digits', 'member_name', 'v1_to_v2',
+           'Attachment', 'ExportError', 'ExportReader', 'ExportWriter', 'copy_member']
@@ -0,0 +1,26 @@
+# This file is part of SMS Import / Export, and is licensed under the GNU General Public License, version 3 or later;
+# see __init__.py.
+
+# JSON parsing and serialization, with orjson if it is installed (several times faster than the json module, on both),
+# and the json module otherwise. Records are serialized as bytes: with the json module, as the tools have always written
+# them (json.dumps() with its default separators); with orjson, compactly and without escaping non-ASCII characters,
+# which the app reads just the same.
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAVE_ORJSON = orjson is not None
+
+
+def loads(data):
+    """Parse a JSON document from bytes or str."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def dumps(obj):
+    """Serialize obj to bytes, without a trailing newline."""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
@@ -0,0 +1,40 @@
+# This file is part of SMS Import / Export, and is licensed under the GNU General Public License, version 3 or later;
+# see __init__.py.
+
+import re
+
+# What the app's exports look like.
+
+# Zip files containing NDJSON, by the name of the NDJSON member; messages zip files also contain MMS attachments under
+# data/, after messages.ndjson (the app reads the zip file sequentially, and expects messages.ndjson first)
+NDJSON_MEMBERS = {'messages.ndjson': 'messages', 'blocked_numbers.ndjson': 'blocked_numbers'}
+# Exports that are a single JSON array, as named by the app (calls-yyyy-MM-dd.json, etc.); messages exports were
+# arrays too, in v1 format, before version 2.0.0
+ARRAY_KINDS = ('calls', 'contacts', 'messages')
+DATA_DIRECTORY = 'data/'
+# Fields added to v1 messages (and their parts) by the app, which are prefixed with '__' in v2 format
+CUSTOM_NAMES = {'display_name', 'parts', 'addresses', 'sender_address', 'recipient_addresses'}
+NON_DIGITS = re.compile(r'\D')
+
+
+def digits(address):
+    """Addresses are compared by their digits, so that e.g. '+1 (555) 123-4567' matches '+15551234567' (addresses
+    without digits, e.g. alphanumeric sender IDs, are kept as they are)."""
+    return NON_DIGITS.sub('', address or '') or (address or '')
+
+
+def member_name(part):
+    """The name of the zip file member holding an MMS part's binary data, which the app names after the last segment
+    of the part's _data path."""
+    return DATA_DIRECTORY + part['_data'].rsplit('/', 1)[-1]
+
+
+def v1_to_v2(message):
+    """Convert a message from v1 format to v2 format, leaving out any base64 encoded binary data, which v2 format keeps
+    in separate files."""
+    converted = {}
+    for k, v in message.items():
+        if k != 'binary_data':
+            converted['__' + k if k in CUSTOM_NAMES else k] = \
+                [v1_to_v2(x) for x in v] if isinstance(v, list) else v1_to_v2(v) if isinstance(v, dict) else v
+    return converted
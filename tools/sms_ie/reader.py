@@ -0,0 +1,277 @@
+# This file is part of SMS Import / Export, and is licensed under the GNU General Public License, version 3 or later;
+# see __init__.py.
+
+import io
+import os
+import re
+import zipfile
+
+from .fastjson import loads
+from .formats import ARRAY_KINDS, DATA_DIRECTORY, NDJSON_MEMBERS, member_name
+
+READ_SIZE = 1 << 20
+SSEF_MAGIC_NUMBER = b'SSEF\x00\xff'
+ZIP_MAGIC_NUMBER = b'PK\x03\x04'  # the app's zip files start with a local file header
+STRUCTURE = re.compile(rb'[]["{}]')
+STRING_END = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)  # from just after the opening quote
+STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)  # up to the closing quote, or a split escape
+KEY_LOOKAHEAD = 64  # bytes needed after a string's opening quote to recognize a streamed key
+WHITESPACE = re.compile(rb'[ \t\r\n]*')
+
+
+class ExportError(Exception):
+    pass
+
+
+def peek(f, n):
+    if hasattr(f, 'peek'):
+        return f.peek(n)[:n]
+    position = f.tell()
+    data = f.read(n)
+    f.seek(position)
+    return data
+
+
+def ndjson_lines(f):
+    """Yield the non-blank lines of the binary file f, without their line endings."""
+    pending = []  # pieces of a line begun in earlier blocks, joined once its end is found
+    while block := f.read(READ_SIZE):
+        lines = block.split(b'\n')
+        if len(lines) == 1:
+            pending.append(block)
+            continue
+        if pending:
+            pending.append(lines[0])
+            lines[0] = b''.join(pending)
+            pending = []
+        rest = lines.pop()
+        if rest:
+            pending.append(rest)
+        for line in lines:
+            if line.strip():
+                yield line
+    rest = b''.join(pending)
+    if rest.strip():
+        yield rest
+
+
+def array_elements(f, streamed_key=None, stream=None):
+    """Yield the JSON text of each element of a JSON array of objects in the binary file f, reading only as much of it
+    at a time as is needed to find the end of the current element.
+
+    If streamed_key is given (e.g. b'binary_data'), the string values of fields with that name aren't read into memory:
+    stream is called with an iterator over pieces of each one's (still escaped) text, and returns the escaped text
+    to replace it with in the element."""
+    buf, pos, start = b'', 0, 0  # what precedes buf[start:] has been yielded (or is in pieces)
+    pieces = []
+    key_regex = streamed_key and re.compile(rb'"' + re.escape(streamed_key) + rb'"\s*:\s*"')
+
+    def more():
+        """Read more of f, discarding what precedes buf[start:]."""
+        nonlocal buf, pos, start
+        block = f.read(READ_SIZE)
+        if not block:
+            raise ExportError('Unexpected end of JSON array')
+        buf = buf[start:] + block
+        pos -= start
+        start = 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos < len(buf):
+                pos += 1
+                return buf[pos - 1:pos]
+            more()
+
+    def string_pieces():
+        """Yield pieces of the string starting at pos, leaving pos after its closing quote. Escape sequences aren't
+        split between pieces."""
+        nonlocal pos, start
+        while True:
+            end = STRING_BODY.match(buf, pos).end()
+            piece = buf[pos:end]
+            if buf[end:end + 1] == b'"':
+                pos = end + 1
+                yield piece
+                return
+            pos = start = end
+            if piece:
+                yield piece
+            more()
+
+    if next_char() != b'[':
+        raise ExportError('Expected a JSON array')
+    c = next_char()
+    while c != b']':
+        if c != b'{':
+            raise ExportError(f'Expected a JSON object, found {c!r}')
+        start, depth = pos - 1, 1
+        while depth:
+            m = STRUCTURE.search(buf, pos)
+            if not m:
+                pos = len(buf)
+                more()
+                continue
+            pos = m.end()
+            if m[0] == b'"':
+                if key_regex:
+                    while len(buf) - pos < KEY_LOOKAHEAD:
+                        try:
+                            more()
+                        except ExportError:
+                            break
+                    if key := key_regex.match(buf, pos - 1):
+                        pieces.append(buf[start:key.end()])
+                        pos = key.end()
+                        value = string_pieces()
+                        pieces.append(stream(value))
+                        for _ in value:  # in case stream didn't read all of it
+                            pass
+                        start = pos - 1  # the closing quote
+                        continue
+                while not (string := STRING_END.match(buf, pos)):
+                    more()
+                pos = string.end()
+            elif m[0] == b'[' or m[0] == b'{':
+                depth += 1
+            else:
+                depth -= 1
+        if pieces:
+            pieces.append(buf[start:pos])
+            yield b''.join(pieces)
+            pieces.clear()
+        else:
+            yield buf[start:pos]
+        start = pos
+        c = next_char()
+        if c == b',':
+            c = next_char()
+
+
+class Attachment:
+    """A handle on an MMS part's binary data in a messages zip file. Nothing is read until open() or read() is
+    called."""
+
+    def __init__(self, zip_file, info):
+        self.zip_file = zip_file
+        self.info = info
+        self.name = info.filename
+        self.size = info.file_size
+
+    def open(self):
+        """Return a binary file object streaming the (decompressed) data."""
+        return self.zip_file.open(self.info)
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+    def __repr__(self):
+        return f'<Attachment {self.name} ({self.size} bytes)>'
+
+
+class ExportReader:
+    """An SMS I/E export, read one record at a time: iterating over it yields each record parsed (lines() yields them
+    unparsed). source is a file name, or a binary file object (which must be seekable for zip files). Encrypted files
+    are recognized by their header, and decrypted with passphrase, which can also be a function returning it, so that
+    it's only asked for if needed.
+
+    kind is 'messages', 'blocked_numbers', 'calls' or 'contacts' (or None if it can't be told from the file's name, for
+    JSON arrays), and format is 'zip', 'ndjson' or 'array'. For messages zip files, zip is the ZipFile, and parts() and
+    attachment() give handles on the MMS attachments."""
+
+    def __init__(self, source, passphrase=None):
+        self.owned = []  # files to close, innermost first
+        if isinstance(source, str):
+            self.name = source
+            f = open(source, 'rb')
+            self.owned.append(f)
+        else:
+            self.name = getattr(source, 'name', None)
+            f = source
+        try:
+            self.encrypted = peek(f, len(SSEF_MAGIC_NUMBER)) == SSEF_MAGIC_NUMBER
+            if self.encrypted:
+                f = self.decrypt(f, passphrase() if callable(passphrase) else passphrase)
+            self.zip = None
+            base_name = os.path.basename(str(self.name or '')).removesuffix('.ssef')
+            if peek(f, len(ZIP_MAGIC_NUMBER)) == ZIP_MAGIC_NUMBER:
+                self.format = 'zip'
+                self.zip = zipfile.ZipFile(f)
+                self.owned.append(self.zip)
+                self.member = next((name for name in NDJSON_MEMBERS if name in self.zip.NameToInfo), None)
+                if self.member is None:
+                    raise ExportError(f'{self.name} contains no {" or ".join(NDJSON_MEMBERS)}')
+                self.kind = NDJSON_MEMBERS[self.member]
+            else:
+                self.file = f
+                start = WHITESPACE.match(peek(f, 64)).end()
+                self.format = 'array' if peek(f, start + 1)[start:] == b'[' else 'ndjson'
+                self.kind = next((kind for kind in ARRAY_KINDS if base_name.startswith(kind)), None) \
+                    if self.format == 'array' else next((kind for member, kind in NDJSON_MEMBERS.items()
+                                                         if base_name.startswith(kind)), 'messages')
+        except BaseException:
+            self.close()
+            raise
+
+    def decrypt(self, f, passphrase):
+        try:
+            from ssef import SSEFError, SSEFReader  # in the directory above; requires PyNaCl
+        except ImportError as e:
+            raise ExportError(f'Reading encrypted files requires ssef.py and PyNaCl ({e})')
+        if passphrase is None:
+            raise ExportError(f'{self.name} is encrypted, and no passphrase was given')
+        try:
+            raw = SSEFReader(f, passphrase)
+            decrypted = io.BufferedReader(raw, READ_SIZE)
+            self.owned.append(decrypted)
+            decrypted.peek(1)  # fails here if the passphrase is wrong
+        except SSEFError as e:
+            raise ExportError(str(e))
+        return decrypted
+
+    def lines(self):
+        """Yield the JSON text (bytes) of each record."""
+        if self.zip:
+            with self.zip.open(self.member) as f:
+                yield from ndjson_lines(f)
+        elif self.format == 'array':
+            yield from array_elements(self.file)
+        else:
+            yield from ndjson_lines(self.file)
+
+    def __iter__(self):
+        for line in self.lines():
+            yield loads(line)
+
+    def attachment(self, part):
+        """The Attachment holding an MMS part's binary data, or None if it has none (or it's missing)."""
+        if self.zip is None or '_data' not in part:
+            return None
+        info = self.zip.NameToInfo.get(member_name(part))
+        return Attachment(self.zip, info) if info else None
+
+    def parts(self, message):
+        """Yield (part, attachment) for each of an MMS message's parts, attachment being None if it has no data."""
+        for part in message.get('__parts', ()):
+            yield part, self.attachment(part)
+
+    def attachments(self):
+        """Yield an Attachment for each binary data member of a messages zip file, in the order they are stored."""
+        if self.zip:
+            for info in self.zip.infolist():
+                if info.filename.startswith(DATA_DIRECTORY) and not info.is_dir():
+                    yield Attachment(self.zip, info)
+
+    def close(self):
+        for f in reversed(self.owned):
+            f.close()
+        self.owned.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,167 @@
+# This file is part of SMS Import / Export, and is licensed under the GNU General Public License, version 3 or later;
+# see __init__.py.
+
+from copy import copy
+import shutil
+import struct
+import time
+import zipfile
+
+from .fastjson import dumps
+from .formats import NDJSON_MEMBERS
+from .reader import Attachment
+
+BUFFER_SIZE = 1 << 20  # bytes of records collected before they are written to the zip file
+COPY_SIZE = 1 << 20
+
+
+def copy_member(source, info, destination):
+    """Copy a member from the ZipFile source to the ZipFile destination without decompressing and recompressing it."""
+    source.fp.seek(info.header_offset)
+    name_length, extra_length = struct.unpack('<HH', source.fp.read(30)[26:30])
+    source.fp.seek(info.header_offset + 30 + name_length + extra_length)
+    info = copy(info)
+    info.flag_bits &= ~0x08  # the CRC and sizes go in the local header, so no data descriptor is needed
+    info.extra = b''
+    info.header_offset = destination.fp.tell()
+    destination.fp.write(info.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, COPY_SIZE))
+        if not chunk:
+            raise EOFError(f'{info.filename} is truncated')
+        destination.fp.write(chunk)
+        remaining -= len(chunk)
+    destination.filelist.append(info)
+    destination.NameToInfo[info.filename] = info
+    destination.start_dir = destination.fp.tell()
+
+
+class ExportWriter:
+    """Write an export in the format the app imports, one record at a time: a zip file containing messages.ndjson (and
+    then the MMS attachments) or blocked_numbers.ndjson, or, for calls and contacts, a JSON array. target is a file name
+    or a binary file object, which needn't be seekable. With a passphrase, the file is encrypted (keyword arguments are
+    passed to ssef.SSEFWriter, e.g. chunk_size). date_time is the zip members' modification time (default: now), and
+    attachment_compression how attachments other than copied ones are compressed (ZIP_STORED only suits seekable
+    targets: otherwise the members need data descriptors, which the app can only read for deflated members)."""
+
+    def __init__(self, target, kind='messages', passphrase=None, date_time=None,
+                 attachment_compression=zipfile.ZIP_DEFLATED, **encryption):
+        self.kind = kind
+        self.date_time = date_time or time.localtime()[:6]
+        self.attachment_compression = attachment_compression
+        self.owned = []  # files to close, outermost first
+        self.buffer = []
+        self.buffered = 0
+        self.attachments = []  # (name, source), written after the records
+        self.zip = None
+        self.closed = False
+        f = target
+        if isinstance(target, str):
+            f = open(target, 'wb')
+            self.owned.append(f)
+        try:
+            if passphrase is not None:
+                from ssef import SSEFWriter  # in the directory above; requires PyNaCl
+                f = SSEFWriter(f, passphrase, **encryption)
+                self.owned.insert(0, f)
+            member = next((member for member, k in NDJSON_MEMBERS.items() if k == kind), None)
+            if member:
+                # Deflated, since the app can't read stored members written with data descriptors, as they are when
+                # the file isn't seekable (e.g. when it's encrypted)
+                self.zip = zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED)
+                self.owned.insert(0, self.zip)
+                self.file = self.zip.open(self.member_info(member), 'w', force_zip64=True)
+                self.owned.insert(0, self.file)
+            else:
+                self.file = f
+                self.file.write(b'[')
+                self.separator = b'\n'
+        except BaseException:
+            while self.owned:
+                self.owned.pop(0).close()
+            raise
+
+    def write(self, record):
+        self.write_line(dumps(record))
+
+    def write_line(self, line):
+        """Write a record already serialized as JSON (bytes, without a line ending)."""
+        if self.zip:
+            self.buffer.append(line)
+            self.buffer.append(b'\n')
+        else:
+            self.buffer.append(self.separator)
+            self.buffer.append(line)
+            self.separator = b',\n'
+        self.buffered += len(line)
+        if self.buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def write_ndjson(self, data):
+        """Write records already serialized as NDJSON (bytes of whole lines), to a zip file."""
+        self.flush()
+        self.file.write(data)
+
+    def flush(self):
+        self.file.write(b''.join(self.buffer))
+        self.buffer.clear()
+        self.buffered = 0
+
+    def member_info(self, name, compression=zipfile.ZIP_DEFLATED):
+        info = zipfile.ZipInfo(name, self.date_time)
+        info.compress_type = compression
+        return info
+
+    def add_attachment(self, name, source):
+        """Add an MMS part's binary data (to be written when the records are done, since the app expects them to come
+        after messages.ndjson) from an Attachment (which is copied without decompression), a file name, bytes, or a
+        function returning bytes (called only when they are written, so that they needn't all be held in memory)."""
+        if self.kind != 'messages':
+            raise ValueError('Only messages exports have attachments')
+        self.add_member(name, source)
+
+    def add_member(self, name, source):
+        """Add a member to a zip file, after the records and the attachments added before it, from the same kinds of
+        source as add_attachment()."""
+        self.attachments.append((name, source))
+
+    def write_attachments(self):
+        for name, source in self.attachments:
+            if isinstance(source, Attachment):
+                if source.name == name:
+                    copy_member(source.zip_file, source.info, self.zip)
+                else:
+                    with source.open() as data, \
+                            self.zip.open(self.member_info(name, self.attachment_compression), 'w',
+                                          force_zip64=True) as member:
+                        shutil.copyfileobj(data, member, COPY_SIZE)
+            elif isinstance(source, str):
+                self.zip.write(source, name, self.attachment_compression)
+            else:
+                self.zip.writestr(self.member_info(name, self.attachment_compression),
+                                  source() if callable(source) else source)
+        self.attachments.clear()
+
+    def close(self):
+        """Finish the file: the outermost layer (NDJSON member, zip file, encryption, file) is closed first."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.zip:
+                self.flush()
+                self.owned.pop(0).close()  # messages.ndjson
+                self.write_attachments()
+            else:
+                self.buffer.append(b'\n]\n' if self.separator != b'\n' else b']\n')
+                self.flush()
+        finally:
+            while self.owned:
+                self.owned.pop(0).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
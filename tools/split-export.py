@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: split-export.py [--by {date,thread,size}] [--period {year,month,day}] [--size SIZE] messages-xxx.zip
+# Splits a messages export into smaller ones (shards), which can be imported separately: by the period (year, month or
+# day) of the messages' dates, by thread, or into shards of about a given size. With --size, shards by date are also
+# split when they would be larger than it, and threads are packed together into shards of up to that size (a thread
+# is never split), instead of each having a shard of its own.
+#
+# messages.ndjson is read once, its lines being spooled to a temporary file and indexed by shard, along with the
+# attachments each message refers to; each shard is then written from the spool, with its messages in their original
+# order, and only the attachments they refer to, copied without being decompressed. (The app exports all the SMS
+# before all the MMS, so shards can't simply be written one after another as the messages are read.)
+
+import argparse
+from array import array
+from datetime import datetime
+from getpass import getpass
+import os
+import re
+import sys
+import tempfile
+
+from sms_ie import Attachment, ExportError, ExportReader, ExportWriter, loads
+
+PERIODS = {'year': '%Y', 'month': '%Y-%m', 'day': '%Y-%m-%d'}
+MEMBER_OVERHEAD = 150  # bytes of zip headers per attachment, roughly
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(text):
+    """Parse a size in bytes, with an optional K, M, G or T suffix (powers of 1024)."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?', text.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid size: {text}')
+    return int(float(match[1]) * SIZE_UNITS[match[2].upper()])
+
+
+def message_date(message):
+    """A message's date, in seconds (MMS dates are in seconds, SMS ones in milliseconds)."""
+    date = int(message.get('date') or 0)
+    return date if 'msg_box' in message or '__parts' in message else date / 1000
+
+
+class Group:
+    """The messages with the same shard key: where their lines are in the spool, and their (estimated) sizes in a
+    shard."""
+
+    def __init__(self):
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.sizes = array('Q')
+        self.size = 0
+
+    def add(self, offset, length, size):
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.sizes.append(size)
+        self.size += size
+
+    def messages(self, start=0, end=None):
+        return list(zip(self.offsets[start:end], self.lengths[start:end]))
+
+
+def index_messages(reader, spool, key):
+    """Copy reader's messages to spool, returning ({shard key: Group}, {spool offset: names of the attachments the
+    message there refers to})."""
+    groups = {}
+    attachments = {}
+    # Messages are counted at their compressed size, estimated from how well the export's messages.ndjson compressed
+    ratio = 1.0
+    if reader.zip:
+        info = reader.zip.NameToInfo[reader.member]
+        ratio = info.compress_size / info.file_size if info.file_size else 1.0
+    for line in reader.lines():
+        message = loads(line)
+        offset = spool.tell()
+        spool.write(line + b'\n')
+        size = int(len(line) * ratio)
+        if b'"_data"' in line:
+            names = []
+            for part, attachment in reader.parts(message):
+                if attachment and attachment.name not in names:
+                    names.append(attachment.name)
+                    size += attachment.info.compress_size + MEMBER_OVERHEAD
+            if names:
+                attachments[offset] = names
+        shard_key = key(message)
+        group = groups.get(shard_key)
+        if group is None:
+            group = groups[shard_key] = Group()
+        group.add(offset, len(line), size)
+    return groups, attachments
+
+
+def split_group(group, max_size):
+    """Split a group's messages into runs of at most max_size bytes (or of one message, if it is larger)."""
+    start = size = 0
+    for i, message_size in enumerate(group.sizes):
+        if max_size and i > start and size + message_size > max_size:
+            yield group.messages(start, i)
+            start, size = i, 0
+        size += message_size
+    yield group.messages(start)
+
+
+def plan(groups, by, max_size):
+    """Yield (name, messages) for each shard, messages being [(spool offset, length)]."""
+    if by == 'thread' and max_size:  # threads packed together
+        shard, size, n = [], 0, 0
+        for group in groups.values():
+            if shard and size + group.size > max_size:
+                n += 1
+                yield f'threads-{n:03}', shard
+                shard, size = [], 0
+            shard += group.messages()
+            size += group.size
+        if shard:
+            yield f'threads-{n + 1:03}', shard
+        return
+    for key, group in sorted(groups.items()) if by == 'date' else groups.items():
+        parts = list(split_group(group, max_size))
+        for n, messages in enumerate(parts, 1):
+            if by == 'size':
+                yield f'{n:03}', messages
+            else:
+                name = f'thread-{key}' if by == 'thread' else key
+                yield name if len(parts) == 1 else f'{name}-{n:03}', messages
+
+
+def write_shard(file_name, messages, spool, attachments, reader):
+    """Write a shard of messages, in their original order, with the attachments they refer to, returning the number
+    of attachments."""
+    stored = set()
+    with ExportWriter(file_name) as writer:
+        for offset, length in sorted(messages):
+            spool.seek(offset)
+            writer.write_line(spool.read(length))
+            for name in attachments.get(offset, ()):
+                if name not in stored:
+                    stored.add(name)
+                    writer.add_attachment(name, Attachment(reader.zip, reader.zip.NameToInfo[name]))
+    return len(stored)
+
+
+def split(reader, by, period, max_size, output_directory, temporary_directory):
+    """Split the export reader into shards, written to output_directory, returning the shards' file names."""
+    if by == 'date':
+        date_format = PERIODS[period]
+
+        def key(message):
+            return datetime.fromtimestamp(message_date(message)).strftime(date_format)
+    elif by == 'thread':
+        def key(message):
+            return message.get('thread_id', '')
+    else:
+        def key(message):
+            return None
+    stem = re.sub(r'(\.zip)?(\.ssef)?$', '', os.path.basename(reader.name))
+    file_names = []
+    with tempfile.TemporaryFile(dir=temporary_directory) as spool:
+        groups, attachments = index_messages(reader, spool, key)
+        for name, messages in plan(groups, by, max_size):
+            file_name = os.path.join(output_directory, f'{stem}-{name}.zip')
+            count = write_shard(file_name, messages, spool, attachments, reader)
+            print(f'{file_name}: {len(messages)} messages, {count} attachments, '
+                  f'{os.path.getsize(file_name) / 1e6:.1f} MB', file=sys.stderr)
+            file_names.append(file_name)
+    return file_names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split an SMS Import / Export messages export into smaller ones.')
+    parser.add_argument('input_file', help='messages-xxx.zip file, possibly encrypted')
+    parser.add_argument('-b', '--by', choices=('date', 'thread', 'size'), default='date',
+                        help='split by the period of the messages\' dates, by thread, or by size only '
+                             '(default: %(default)s)')
+    parser.add_argument('-p', '--period', choices=PERIODS, default='month',
+                        help='period of the shards, when splitting by date (default: %(default)s)')
+    parser.add_argument('-s', '--size', type=parse_size,
+                        help='largest size of a shard (approximately), e.g. 500M or 2G; required with --by size')
+    parser.add_argument('-d', '--directory', default='.',
+                        help='directory to write the shards to (default: the current directory)')
+    parser.add_argument('-T', '--temporary-directory',
+                        help='directory for the spooled messages (default: the system\'s)')
+    args = parser.parse_args()
+    if args.by == 'size' and not args.size:
+        parser.error('--by size requires --size')
+
+    try:
+        with ExportReader(args.input_file, lambda: getpass('Enter passphrase: ')) as reader:
+            if reader.kind != 'messages':
+                sys.exit(f'{args.input_file} is not a messages export')
+            if reader.format == 'array':
+                sys.exit(f'{args.input_file} is a v1 export; convert it with v1-v2-convert.py first')
+            os.makedirs(args.directory, exist_ok=True)
+            shards = split(reader, args.by, args.period, args.size, args.directory, args.temporary_directory)
+    except ExportError as e:
+        sys.exit(str(e))
+    print(f'{len(shards)} shards', file=sys.stderr)
@@ -1,60 +1,155 @@
 #! /usr/bin/env python3
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import os
 import sys
-import nacl.pwhash
-import nacl.bindings.crypto_secretstream
-import nacl.exceptions
+import time
 from getpass import getpass
 
-MAGIC_NUMBER = b'SSEF\x00\xff'
-FORMAT_VERSION = b'\0\1'
-SALT_LENGTH = 16
-INTEGER_LENGTH = 4
-HEADER_LENGTH = len(MAGIC_NUMBER) + len(FORMAT_VERSION) + (2 * INTEGER_LENGTH) + SALT_LENGTH
-ENCRYPTION_KEY_LENGTH = 32
-FILENAME_SUFFIX = '.ssef'
+from ssef import FILENAME_SUFFIX, SSEFError, SSEFReader, derive_key, read_header
+
 SCRIPT_NAME = 'ssef-decrypt.py'
+COPY_SIZE = 1 << 20
+
+
+def decrypt(encrypted_filename, decrypted_filename, passphrase=None, key=None):
+    """Decrypt encrypted_filename to decrypted_filename ('-' for standard output), returning the plaintext size."""
+    with open(encrypted_filename, 'rb') as encrypted_file, SSEFReader(encrypted_file, passphrase, key) as reader, \
+            open(sys.stdout.fileno(), 'wb', closefd=False) if decrypted_filename == '-' \
+            else open(decrypted_filename, 'wb') as decrypted_file:
+        size = 0
+        while chunk := reader.read(COPY_SIZE):
+            decrypted_file.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def timed_derive_key(passphrase, kdf_parameters):
+    start = time.perf_counter()
+    key = derive_key(passphrase, *kdf_parameters)
+    return key, time.perf_counter() - start
+
+
+def timed_decrypt(encrypted_filename, decrypted_filename, key):
+    """decrypt() for batch mode, returning (size, seconds), and removing the partial output on failure."""
+    start = time.perf_counter()
+    try:
+        size = decrypt(encrypted_filename, decrypted_filename, key=key)
+    except BaseException:
+        if os.path.exists(decrypted_filename):
+            os.remove(decrypted_filename)
+        raise
+    return size, time.perf_counter() - start
 
-if len(sys.argv) < 2 or len(sys.argv) > 3:
-    sys.exit(f'Usage: {SCRIPT_NAME} <encrypted_file> [<decrypted_file>]')
-if len(sys.argv) == 2 and not sys.argv[1].endswith(FILENAME_SUFFIX):
-    sys.exit(f'Two argument form is only allowed with a filename ending in {FILENAME_SUFFIX}')
-decrypted_filename = sys.argv[2] if len(sys.argv) == 3 else sys.argv[1].removesuffix(FILENAME_SUFFIX)
-with open(sys.argv[1], 'rb') as encrypted_file:
-    with open(decrypted_filename, 'wb') as decrypted_file:
-        if encrypted_file.read(len(MAGIC_NUMBER)) != MAGIC_NUMBER:
-            sys.exit(f'\'{sys.argv[1]}\' is not an SSEF encrypted file')
-        encrypted_file.seek(len(FORMAT_VERSION), 1)  # we don't currently do anything with the FORMAT_VERSION
-        t_cost_in_iterations = int.from_bytes(encrypted_file.read(INTEGER_LENGTH))
-        m_cost_in_kibibytes = int.from_bytes(encrypted_file.read(INTEGER_LENGTH))
-        salt = encrypted_file.read(SALT_LENGTH)
-        passphrase = getpass("Enter passphrase: ").encode()
-        try:
-            decryption_key = nacl.pwhash.argon2id.kdf(ENCRYPTION_KEY_LENGTH, passphrase, salt, t_cost_in_iterations,
-                                                      m_cost_in_kibibytes)
-        except nacl.exceptions.RuntimeError:
-            sys.exit('Key derivation failure, probably due to memory allocation failure')
-        encrypted_chunk_size = int.from_bytes(encrypted_file.read(
-            INTEGER_LENGTH)) + nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_ABYTES
-        st = nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_state()
-        secret_stream_header = encrypted_file.read(
-            nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_HEADERBYTES)
-        try:
-            nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_init_pull(st, secret_stream_header,
-                                                                                              decryption_key)
-        except nacl.exceptions.RuntimeError:
-            sys.exit('Incomplete SecretStream header')
-        chunk_number = 1
-        while True:
-            encrypted_chunk = encrypted_file.read(encrypted_chunk_size)
+
+def default_jobs(kdf_parameters):
+    """As many worker processes as there are CPU cores, or as can derive keys at once in the available memory."""
+    jobs = os.cpu_count() or 1
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):  # not available on all platforms
+        return jobs
+    # Like the app, derive_key() passes the header's m_cost to libsodium, which takes it as a number of bytes
+    largest_m_cost = max((m_cost_in_kibibytes for _, _, m_cost_in_kibibytes in kdf_parameters), default=0)
+    return max(1, min(jobs, available // max(1, largest_m_cost)))
+
+
+def batch_decrypt(paths, output_directory, jobs):
+    """Decrypt many files, deriving the key once for each distinct salt and set of Argon2id parameters."""
+    files = []  # (encrypted filename, decrypted filename, (salt, t_cost_in_iterations, m_cost_in_kibibytes))
+    for path in paths:
+        names = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(FILENAME_SUFFIX)) \
+            if os.path.isdir(path) else [path]
+        for name in names:
+            if not name.endswith(FILENAME_SUFFIX):
+                print(f'{name}: skipped, since its name doesn\'t end in {FILENAME_SUFFIX}', file=sys.stderr)
+                continue
             try:
-                decrypted_chunk, tag = nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_pull(st,
-                                                                                                                    encrypted_chunk)
-            except nacl.exceptions.RuntimeError:
-                sys.exit(f'Decryption failure on chunk {chunk_number}')
-            if decrypted_chunk == b'':
-                sys.exit('End of file reached before end of stream')
-            decrypted_file.write(decrypted_chunk)
-            if tag == nacl.bindings.crypto_secretstream.crypto_secretstream_xchacha20poly1305_TAG_FINAL:
-                sys.exit(None if encrypted_file.read(1) == b'' else 'End of stream reached before end of file')
-            chunk_number += 1
+                with open(name, 'rb') as f:
+                    t_cost_in_iterations, m_cost_in_kibibytes, salt, _, _ = read_header(f, name)
+            except (OSError, SSEFError) as e:
+                print(f'{name}: {e}', file=sys.stderr)
+                continue
+            decrypted_filename = name.removesuffix(FILENAME_SUFFIX)
+            if output_directory:
+                decrypted_filename = os.path.join(output_directory, os.path.basename(decrypted_filename))
+            files.append((name, decrypted_filename, (salt, t_cost_in_iterations, m_cost_in_kibibytes)))
+    if not files:
+        sys.exit('No files to decrypt')
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    passphrase = getpass("Enter passphrase: ")
+    kdf_parameters = list(dict.fromkeys(parameters for _, _, parameters in files))
+    jobs = jobs or default_jobs(kdf_parameters)
+    print(f'Decrypting {len(files)} files ({len(kdf_parameters)} key derivations) with {jobs} processes',
+          file=sys.stderr)
+    start = time.perf_counter()
+    failures = total_size = 0
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = {executor.submit(timed_derive_key, passphrase, parameters): parameters
+                   for parameters in kdf_parameters}
+        kdf_times = {}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                if isinstance(task, tuple):  # a key derivation
+                    try:
+                        key, kdf_times[task] = future.result()
+                    except SSEFError as e:
+                        names = [name for name, _, parameters in files if parameters == task]
+                        print(f'{", ".join(names)}: {e}', file=sys.stderr)
+                        failures += len(names)
+                        continue
+                    for name, decrypted_filename, parameters in files:
+                        if parameters == task:
+                            pending[executor.submit(timed_decrypt, name, decrypted_filename, key)] = name
+                    continue
+                name = task
+                try:
+                    size, seconds = future.result()
+                except (OSError, SSEFError) as e:
+                    print(f'{name}: {e}', file=sys.stderr)
+                    failures += 1
+                    continue
+                total_size += size
+                parameters = next(parameters for n, _, parameters in files if n == name)
+                print(f'{name}: key derivation {kdf_times[parameters]:.3f} s, decryption {seconds:.3f} s '
+                      f'({size / max(seconds, 1e-9) / 1e6:.1f} MB/s)', file=sys.stderr)
+    seconds = time.perf_counter() - start
+    print(f'Decrypted {len(files) - failures} of {len(files)} files ({total_size / 1e6:.1f} MB) in {seconds:.2f} s',
+          file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=SCRIPT_NAME, description='Decrypt SMS Import / Export encrypted files.')
+    parser.add_argument('files', nargs='+', metavar='file',
+                        help='<encrypted_file> [<decrypted_file> | -], or with --batch, encrypted files and directories '
+                             'containing them')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help=f'decrypt each file (or each {FILENAME_SUFFIX} file in each directory) in parallel, '
+                             'asking for the passphrase once')
+    parser.add_argument('-o', '--output-directory',
+                        help='with --batch, write the decrypted files here instead of next to the encrypted ones')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='with --batch, worker processes (default: as many as there are CPU cores, or as can derive '
+                             'keys at once in the available memory)')
+    args = parser.parse_args()
+
+    if args.batch:
+        batch_decrypt(args.files, args.output_directory, args.jobs)
+        sys.exit()
+    if len(args.files) > 2:
+        sys.exit(f'Usage: {SCRIPT_NAME} <encrypted_file> [<decrypted_file> | -]')
+    if len(args.files) == 1 and not args.files[0].endswith(FILENAME_SUFFIX):
+        sys.exit(f'Two argument form is only allowed with a filename ending in {FILENAME_SUFFIX}')
+    decrypted_filename = args.files[1] if len(args.files) == 2 else args.files[0].removesuffix(FILENAME_SUFFIX)
+    try:
+        with open(args.files[0], 'rb') as f:
+            read_header(f, args.files[0])  # check that it's an SSEF file before asking for the passphrase
+        decrypt(args.files[0], decrypted_filename, getpass("Enter passphrase: "))
+    except SSEFError as e:
+        sys.exit(str(e))
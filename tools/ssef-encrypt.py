@@ -0,0 +1,173 @@
+#! /usr/bin/env python3
+
+# Usage: ssef-encrypt.py <plaintext_file | -> [<encrypted_file> | -]
+#        ssef-encrypt.py --benchmark <megabytes>
+# The plaintext is read, encrypted and written by three threads connected by bounded queues, so that reading and
+# writing overlap with encryption (libsodium runs without holding the GIL).
+
+import argparse
+import hashlib
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from getpass import getpass
+
+from ssef import (DEFAULT_CHUNK_SIZE, FILENAME_SUFFIX, M_COST_IN_KIBIBYTES, T_COST_IN_ITERATIONS, SSEFEncryptor,
+                  SSEFError, SSEFReader, derive_key)
+
+SCRIPT_NAME = 'ssef-encrypt.py'
+QUEUE_CHUNKS = 64  # chunks waiting to be encrypted, and to be written
+COPY_SIZE = 1 << 20
+
+
+def read_chunks(f, chunk_size, chunks, errors):
+    """Producer: put chunk_size pieces of the binary file f (the last one possibly shorter) on the queue chunks,
+    followed by None."""
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            while chunk and len(chunk) < chunk_size:  # short reads happen on pipes
+                more = f.read(chunk_size - len(chunk))
+                if not more:
+                    break
+                chunk += more
+            if not chunk:
+                break
+            chunks.put(chunk)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        chunks.put(None)
+
+
+def write_chunks(f, chunks, errors):
+    """Consumer: write the encrypted chunks on the queue chunks to the binary file f, until None."""
+    while (chunk := chunks.get()) is not None:
+        if not errors:  # keep draining after a failure, so that the encrypting thread isn't blocked
+            try:
+                f.write(chunk)
+            except BaseException as e:
+                errors.append(e)
+
+
+def encrypt(plaintext_file, encrypted_file, encryptor):
+    """Encrypt the binary file plaintext_file to the binary file encrypted_file, returning the plaintext size."""
+    plaintext_chunks, encrypted_chunks = queue.Queue(QUEUE_CHUNKS), queue.Queue(QUEUE_CHUNKS)
+    errors = []
+    reader = threading.Thread(target=read_chunks, args=(plaintext_file, encryptor.chunk_size, plaintext_chunks, errors),
+                              daemon=True)
+    writer = threading.Thread(target=write_chunks, args=(encrypted_file, encrypted_chunks, errors))
+    reader.start()
+    writer.start()
+    size = 0
+    try:
+        encrypted_chunks.put(encryptor.header)
+        chunk = plaintext_chunks.get()
+        # A chunk is only known not to be the final one when the next one arrives; an empty input is a single empty
+        # final chunk, as in the app
+        while chunk is not None:
+            following = plaintext_chunks.get()
+            encrypted_chunks.put(encryptor.encrypt(chunk, final=following is None))
+            size += len(chunk)
+            chunk = following
+        if size == 0:
+            encrypted_chunks.put(encryptor.encrypt(b'', final=True))
+    finally:
+        encrypted_chunks.put(None)
+        writer.join()
+    if errors:
+        raise errors[0]
+    return size
+
+
+def encrypt_file(plaintext_filename, encrypted_filename, encryptor):
+    with open(sys.stdin.fileno(), 'rb', closefd=False) if plaintext_filename == '-' \
+            else open(plaintext_filename, 'rb') as plaintext_file, \
+            open(sys.stdout.fileno(), 'wb', closefd=False) if encrypted_filename == '-' \
+            else open(encrypted_filename, 'wb') as encrypted_file:
+        return encrypt(plaintext_file, encrypted_file, encryptor)
+
+
+def benchmark(megabytes, chunk_sizes, t_cost_in_iterations, m_cost_in_kibibytes):
+    """Round trip random data through encrypt() and SSEFReader (as used by ssef-decrypt.py) with each chunk size,
+    checking that it survives, and print the throughput of each direction."""
+    passphrase = os.urandom(16).hex()
+    salt = os.urandom(16)
+    start = time.perf_counter()
+    key = derive_key(passphrase, salt, t_cost_in_iterations, m_cost_in_kibibytes)
+    print(f'key derivation: {time.perf_counter() - start:.3f} s')
+    with tempfile.TemporaryDirectory() as directory:
+        plaintext_filename = os.path.join(directory, 'plaintext')
+        encrypted_filename = plaintext_filename + FILENAME_SUFFIX
+        digest = hashlib.sha256()
+        with open(plaintext_filename, 'wb') as f:
+            for _ in range(megabytes):
+                block = os.urandom(1 << 20)
+                digest.update(block)
+                f.write(block)
+        size = megabytes << 20
+        for chunk_size in chunk_sizes:
+            encryptor = SSEFEncryptor(key=key, salt=salt, t_cost_in_iterations=t_cost_in_iterations,
+                                      m_cost_in_kibibytes=m_cost_in_kibibytes, chunk_size=chunk_size)
+            start = time.perf_counter()
+            encrypt_file(plaintext_filename, encrypted_filename, encryptor)
+            encryption = time.perf_counter() - start
+            check = hashlib.sha256()
+            start = time.perf_counter()
+            with SSEFReader(encrypted_filename, key=key) as reader:
+                while chunk := reader.read(COPY_SIZE):
+                    check.update(chunk)
+            decryption = time.perf_counter() - start
+            if check.digest() != digest.digest():
+                sys.exit(f'chunk size {chunk_size}: round trip failed')
+            print(f'chunk size {chunk_size}: encryption {size / encryption / 1e6:.1f} MB/s, '
+                  f'decryption {size / decryption / 1e6:.1f} MB/s')
+
+
+def positive(value):
+    if (number := int(value)) <= 0:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=SCRIPT_NAME, description='Encrypt files in SMS Import / Export\'s encrypted '
+                                                                   'file format, for importing into the app.')
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help=f'<plaintext_file | -> [<encrypted_file> | -] (default: <plaintext_file>{FILENAME_SUFFIX})')
+    parser.add_argument('-c', '--chunk-size', type=positive, default=DEFAULT_CHUNK_SIZE,
+                        help='plaintext bytes per SecretStream chunk (default: %(default)s, as in the app)')
+    parser.add_argument('-t', '--t-cost', type=positive, default=T_COST_IN_ITERATIONS,
+                        help='Argon2id iterations (default: %(default)s, as in the app)')
+    parser.add_argument('-m', '--m-cost', type=positive, default=M_COST_IN_KIBIBYTES,
+                        help='Argon2id memory cost, stored in the header, which libsodium (and therefore the app) takes as '
+                             'a number of bytes (default: %(default)s, as in the app)')
+    parser.add_argument('--benchmark', type=positive, metavar='MEGABYTES',
+                        help='instead of encrypting a file, round trip this much random data through encryption and '
+                             'decryption with the given chunk size and some others, and print the throughput')
+    args = parser.parse_args()
+
+    try:
+        if args.benchmark:
+            benchmark(args.benchmark, sorted({1 << 14, DEFAULT_CHUNK_SIZE, 1 << 20, args.chunk_size}), args.t_cost,
+                      args.m_cost)
+            sys.exit()
+        if not 1 <= len(args.files) <= 2 or (len(args.files) == 1 and args.files[0] == '-'):
+            sys.exit(f'Usage: {SCRIPT_NAME} <plaintext_file | -> [<encrypted_file> | -]')
+        encrypted_filename = args.files[1] if len(args.files) == 2 else args.files[0] + FILENAME_SUFFIX
+        passphrase = getpass('Enter passphrase: ')
+        if getpass('Confirm passphrase: ') != passphrase:
+            sys.exit('The passphrases don\'t match')
+        encryptor = SSEFEncryptor(passphrase, t_cost_in_iterations=args.t_cost, m_cost_in_kibibytes=args.m_cost,
+                                  chunk_size=args.chunk_size)
+        try:
+            encrypt_file(args.files[0], encrypted_filename, encryptor)
+        except BaseException:
+            if encrypted_filename != '-' and os.path.exists(encrypted_filename):
+                os.remove(encrypted_filename)
+            raise
+    except SSEFError as e:
+        sys.exit(str(e))
@@ -0,0 +1,273 @@
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Reading and writing SMS I/E encrypted files (SSEF): a header with the Argon2id parameters and salt used to derive the
+# key from the passphrase, and the plaintext chunk size, followed by a libsodium SecretStream (see ENCRYPTION.md). This
+# module is used by ssef-decrypt.py and ssef-encrypt.py, and by the tools that can read encrypted exports directly. It has
+# a dependency on PyNaCl (Debian package python3-nacl).
+
+from collections import OrderedDict
+import io
+import os
+import threading
+
+import nacl.pwhash
+import nacl.bindings.crypto_secretstream as secretstream
+import nacl.exceptions
+
+MAGIC_NUMBER = b'SSEF\x00\xff'
+FORMAT_VERSION = b'\0\1'
+SALT_LENGTH = 16
+INTEGER_LENGTH = 4
+HEADER_LENGTH = len(MAGIC_NUMBER) + len(FORMAT_VERSION) + (2 * INTEGER_LENGTH) + SALT_LENGTH
+ENCRYPTION_KEY_LENGTH = 32
+FILENAME_SUFFIX = '.ssef'
+# The app's defaults for encryption
+T_COST_IN_ITERATIONS = 3
+M_COST_IN_KIBIBYTES = 65536  # passed to libsodium as is, which takes it as a number of bytes
+DEFAULT_CHUNK_SIZE = 65536
+CHECKPOINT_INTERVAL = 16  # chunks between saved SecretStream states, for seeking
+CACHE_CHUNKS = 4  # decrypted chunks kept in memory
+
+
+class SSEFError(Exception):
+    pass
+
+
+def read_header(f, name='file'):
+    """Read the SSEF header from the binary file f, returning (t_cost_in_iterations, m_cost_in_kibibytes, salt,
+    chunk_size, secret_stream_header)."""
+    if f.read(len(MAGIC_NUMBER)) != MAGIC_NUMBER:
+        raise SSEFError(f'\'{name}\' is not an SSEF encrypted file')
+    f.read(len(FORMAT_VERSION))  # we don't currently do anything with the FORMAT_VERSION
+    t_cost_in_iterations = int.from_bytes(f.read(INTEGER_LENGTH))
+    m_cost_in_kibibytes = int.from_bytes(f.read(INTEGER_LENGTH))
+    salt = f.read(SALT_LENGTH)
+    chunk_size = int.from_bytes(f.read(INTEGER_LENGTH))
+    secret_stream_header = f.read(secretstream.crypto_secretstream_xchacha20poly1305_HEADERBYTES)
+    return t_cost_in_iterations, m_cost_in_kibibytes, salt, chunk_size, secret_stream_header
+
+
+def derive_key(passphrase, salt, t_cost_in_iterations, m_cost_in_kibibytes):
+    if isinstance(passphrase, str):
+        passphrase = passphrase.encode()
+    try:
+        return nacl.pwhash.argon2id.kdf(ENCRYPTION_KEY_LENGTH, passphrase, salt, t_cost_in_iterations,
+                                        m_cost_in_kibibytes)
+    except nacl.exceptions.RuntimeError:
+        raise SSEFError('Key derivation failure, probably due to memory allocation failure')
+
+
+def copy_state(state):
+    copy = secretstream.crypto_secretstream_xchacha20poly1305_state()
+    copy.statebuf[0:secretstream.crypto_secretstream_xchacha20poly1305_STATEBYTES] = \
+        state.statebuf[0:secretstream.crypto_secretstream_xchacha20poly1305_STATEBYTES]
+    copy.tagbuf = state.tagbuf  # scratch space, only used during a pull, so it can be shared
+    return copy
+
+
+class SSEFReader(io.RawIOBase):
+    """A read-only binary file of the plaintext of an SSEF file, decrypted as it is read.
+
+    Reading is sequential on unseekable files. On seekable ones, the SecretStream state is
+    saved every CHECKPOINT_INTERVAL chunks as the file is decrypted, so that seek() (and
+    pread()) can resume decryption from the nearest chunk before the new position; seeking
+    beyond what has been decrypted (e.g. to the end, as ZipFile does) decrypts the chunks
+    in between. Either a passphrase or the key derived from it must be given."""
+
+    def __init__(self, file, passphrase=None, key=None):
+        super().__init__()
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'rb') if self.owns_file else file
+        self.name = getattr(self.file, 'name', 'file')
+        t_cost_in_iterations, m_cost_in_kibibytes, salt, self.chunk_size, secret_stream_header = \
+            read_header(self.file, self.name)
+        if self.chunk_size <= 0:
+            raise SSEFError('Invalid chunk size in file header')
+        self.encrypted_chunk_size = self.chunk_size + secretstream.crypto_secretstream_xchacha20poly1305_ABYTES
+        self.data_start = HEADER_LENGTH + INTEGER_LENGTH + len(secret_stream_header)
+        if key is None:
+            key = derive_key(passphrase, salt, t_cost_in_iterations, m_cost_in_kibibytes)
+        self.state = secretstream.crypto_secretstream_xchacha20poly1305_state()
+        try:
+            secretstream.crypto_secretstream_xchacha20poly1305_init_pull(self.state, secret_stream_header, key)
+        except nacl.exceptions.RuntimeError:
+            raise SSEFError('Incomplete SecretStream header')
+        self.next_chunk = 0  # the chunk self.state will decrypt next
+        self.file_chunk = 0  # the chunk at the underlying file's position
+        self.checkpoints = []  # state before chunk i * CHECKPOINT_INTERVAL
+        self.final_chunk = None  # known once the final chunk has been decrypted
+        self.size = None  # of the plaintext, known likewise
+        self.cache = OrderedDict()  # chunk number -> plaintext, least recently used first
+        self.pos = 0
+        self.lock = threading.Lock()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            with self.lock:
+                while self.size is None:
+                    self.chunk(self.next_chunk)
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f'negative seek position {offset}')
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        data = self.pread(len(b), self.pos)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def pread(self, n, offset):
+        """Read up to n bytes from offset, without changing the file position. Safe to call from several threads."""
+        pieces = []
+        with self.lock:
+            while n > 0:
+                chunk_number, skip = divmod(offset, self.chunk_size)
+                chunk = self.chunk(chunk_number)
+                piece = chunk[skip:skip + n] if chunk else b''
+                if not piece:
+                    break
+                pieces.append(piece)
+                n -= len(piece)
+                offset += len(piece)
+        return b''.join(pieces)
+
+    def chunk(self, i):
+        """The plaintext of chunk i, or None if it is past the end of the stream."""
+        if self.final_chunk is not None and i > self.final_chunk:
+            return None
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+        checkpoint = min(i // CHECKPOINT_INTERVAL, len(self.checkpoints) - 1)
+        if i < self.next_chunk or checkpoint * CHECKPOINT_INTERVAL > self.next_chunk:
+            if not self.seekable():
+                raise io.UnsupportedOperation('seek')
+            self.state = copy_state(self.checkpoints[checkpoint])
+            self.next_chunk = checkpoint * CHECKPOINT_INTERVAL
+        while True:
+            plaintext = self.pull()
+            if self.next_chunk > i or plaintext is None:
+                break
+        if plaintext is not None:
+            self.cache[i] = plaintext
+            if len(self.cache) > CACHE_CHUNKS:
+                self.cache.popitem(last=False)
+        return plaintext
+
+    def pull(self):
+        """Decrypt the next chunk, returning its plaintext, or None if the final chunk has already been decrypted."""
+        i = self.next_chunk
+        if self.final_chunk is not None and i > self.final_chunk:
+            return None
+        if i % CHECKPOINT_INTERVAL == 0 and i // CHECKPOINT_INTERVAL == len(self.checkpoints):
+            self.checkpoints.append(copy_state(self.state))
+        if self.file_chunk != i:
+            self.file.seek(self.data_start + i * self.encrypted_chunk_size)
+        encrypted_chunk = self.file.read(self.encrypted_chunk_size)
+        self.file_chunk = i + 1
+        if len(encrypted_chunk) < secretstream.crypto_secretstream_xchacha20poly1305_ABYTES:
+            raise SSEFError('End of file reached before end of stream')
+        try:
+            plaintext, tag = secretstream.crypto_secretstream_xchacha20poly1305_pull(self.state, encrypted_chunk)
+        except nacl.exceptions.RuntimeError:
+            raise SSEFError(f'Decryption failure on chunk {i + 1}')
+        self.next_chunk = i + 1
+        if tag == secretstream.crypto_secretstream_xchacha20poly1305_TAG_FINAL:
+            if self.file.read(1) != b'':
+                raise SSEFError('End of stream reached before end of file')
+            self.file_chunk = None
+            self.final_chunk = i
+            self.size = i * self.chunk_size + len(plaintext)
+        return plaintext
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        super().close()
+
+
+class SSEFEncryptor:
+    """The header and encrypted chunks of an SSEF file, for a given key (or passphrase), which callers write out
+    themselves: header, then encrypt() for each chunk of plaintext, in order. All chunks but the final one must be
+    chunk_size bytes long."""
+
+    def __init__(self, passphrase=None, key=None, salt=None, t_cost_in_iterations=T_COST_IN_ITERATIONS,
+                 m_cost_in_kibibytes=M_COST_IN_KIBIBYTES, chunk_size=DEFAULT_CHUNK_SIZE):
+        if not 0 < chunk_size < 1 << 31:
+            raise SSEFError('Invalid chunk size')
+        salt = os.urandom(SALT_LENGTH) if salt is None else salt
+        if key is None:
+            key = derive_key(passphrase, salt, t_cost_in_iterations, m_cost_in_kibibytes)
+        self.chunk_size = chunk_size
+        self.state = secretstream.crypto_secretstream_xchacha20poly1305_state()
+        self.header = (MAGIC_NUMBER + FORMAT_VERSION + t_cost_in_iterations.to_bytes(INTEGER_LENGTH)
+                       + m_cost_in_kibibytes.to_bytes(INTEGER_LENGTH) + salt + chunk_size.to_bytes(INTEGER_LENGTH)
+                       + secretstream.crypto_secretstream_xchacha20poly1305_init_push(self.state, key))
+
+    def encrypt(self, plaintext, final=False):
+        tag = secretstream.crypto_secretstream_xchacha20poly1305_TAG_FINAL if final \
+            else secretstream.crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+        return secretstream.crypto_secretstream_xchacha20poly1305_push(self.state, plaintext, None, tag)
+
+
+class SSEFWriter(io.RawIOBase):
+    """A write-only binary file that encrypts what is written to it into an SSEF file, which is completed on close().
+    As in the app, a full chunk is only encrypted once more data follows it, so that the final chunk is never empty
+    unless nothing at all was written. Keyword arguments are passed to SSEFEncryptor."""
+
+    def __init__(self, file, passphrase=None, **kwargs):
+        super().__init__()
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'wb') if self.owns_file else file
+        self.encryptor = SSEFEncryptor(passphrase, **kwargs)
+        self.file.write(self.encryptor.header)
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buffer += b
+        chunk_size = self.encryptor.chunk_size
+        if len(self.buffer) > chunk_size:
+            full = (len(self.buffer) - 1) // chunk_size * chunk_size  # keep at least one byte back
+            for i in range(0, full, chunk_size):
+                self.file.write(self.encryptor.encrypt(bytes(self.buffer[i:i + chunk_size])))
+            del self.buffer[:full]
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.file.write(self.encryptor.encrypt(bytes(self.buffer), final=True))
+            if self.owns_file:
+                self.file.close()
+        super().close()
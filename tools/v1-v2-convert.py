@@ -25,38 +25,59 @@
 #
 # Usage: v1-v2-convert.py <messages-xxx.json>
 # This will read messages from <messages-xxx.json> and write them to <messages-xxx.zip>.
+# The input is parsed incrementally, one message at a time (by the sms_ie package's JSON array scanner), and the
+# base64 encoded binary data is decoded into temporary files as it is read, so memory use does not depend on the size
+# of the input. The messages are converted and written with the sms_ie package (which adds the decoded data to the zip
+# file after messages.ndjson, since the app expects to read that first).
 
 
 import sys
 import json
-import zipfile
-import base64
 import os
+import re
+import tempfile
+from binascii import a2b_base64
+from itertools import count
 
-custom_names = {'display_name', 'parts', 'addresses', 'sender_address', 'recipient_addresses'}
+from sms_ie import ExportError, ExportWriter, member_name, v1_to_v2
+from sms_ie.reader import array_elements
 
+WHITESPACE_ESCAPES = re.compile(rb'\\[nrt]')  # line breaks in base64 data
+NON_BASE64 = re.compile(rb'[^A-Za-z0-9+/=]')
 
-def copy_convert(json_old):
-    json_new = {}
-    for k, v in json_old.items():
-        if k != 'binary_data':
-            new_k = '__' + k if k in custom_names else k
-            new_v = [copy_convert(x) for x in v] if isinstance(v, list) else copy_convert(v) if isinstance(v, dict) else v
-            json_new[new_k] = new_v
-    return json_new
+
+class BlobWriter:
+    """Decodes the base64 "binary_data" values of messages into files in blob_dir, as array_elements() streams them,
+    replacing each with the name of its file."""
+
+    def __init__(self, blob_dir):
+        self.blob_dir = blob_dir
+        self.blob_numbers = count()
+
+    def __call__(self, pieces):
+        path = os.path.join(self.blob_dir, str(next(self.blob_numbers)))
+        pending = b''
+        with open(path, 'wb') as blob:
+            for piece in pieces:  # escape sequences aren't split between pieces
+                pending += NON_BASE64.sub(b'', WHITESPACE_ESCAPES.sub(b'', piece))
+                usable = len(pending) // 4 * 4
+                blob.write(a2b_base64(pending[:usable]))
+                pending = pending[usable:]
+            if pending:
+                blob.write(a2b_base64(pending))
+        return json.dumps(path)[1:-1].encode()
 
 
 input_file = sys.argv[1]
-with open(input_file) as mf:
-    messages_json = json.load(mf)
-messages_ndjson = []
 output_file = input_file[:-4] + 'zip' if input_file[-4:] == 'json' else input_file + 'zip'
-with (zipfile.ZipFile(output_file, mode='w') as messages_zip):
-    for message in messages_json:
-        messages_ndjson.append(json.dumps(copy_convert(message)) + '\n')
-    messages_zip.writestr('messages.ndjson', ''.join(messages_ndjson))
-    for message in messages_json:
-        if 'parts' in message:
-            for part in message['parts']:
+try:
+    with open(input_file, 'rb') as mf, tempfile.TemporaryDirectory() as blob_dir, \
+            ExportWriter(output_file) as messages_zip:
+        for message_text in array_elements(mf, b'binary_data', BlobWriter(blob_dir)):
+            message = json.loads(message_text)
+            messages_zip.write(v1_to_v2(message))
+            for part in message.get('parts', ()):
                 if 'binary_data' in part:
-                    messages_zip.writestr('data/' + os.path.split(part['_data'])[1], base64.b64decode(part['binary_data']))
+                    messages_zip.add_attachment(member_name(part), part['binary_data'])
+except ExportError as e:
+    sys.exit(str(e))
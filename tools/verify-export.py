@@ -0,0 +1,263 @@
+#! /usr/bin/env python3
+
+# SMS Import / Export: a simple Android app for importing and exporting SMS and MMS messages,
+# call logs, and contacts, from and to JSON / NDJSON files.
+#
+# This file is part of SMS Import / Export.
+#
+# SMS Import / Export is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SMS Import / Export is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
+
+# Usage: verify-export.py [-j JOBS] messages-xxx.zip ...
+# Checks that exports can be imported: that every line of messages.ndjson (or blocked_numbers.ndjson, or every record
+# of a calls or contacts file) is a JSON object with the fields the app needs, that every MMS part's binary data is in
+# the zip file, and that every member of the zip file decompresses to its recorded size and CRC. Problems are printed
+# (with line numbers, for malformed lines), as are warnings about attachments no part refers to, and attachments more
+# than one part refers to (which the app gives to only one of them); the exit status is 1 if there were any problems.
+#
+# messages.ndjson is read once, by the main process, while the attachments are checked by a pool of worker processes,
+# in batches of neighbouring members, so that each worker reads the file sequentially.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from getpass import getpass
+import os
+import sys
+import zipfile
+import zlib
+
+from sms_ie import ExportError, ExportReader, loads, member_name
+from sms_ie.formats import DATA_DIRECTORY
+
+READ_SIZE = 1 << 20
+BATCH_SIZE = 64 << 20  # compressed bytes of attachments checked by a worker at a time
+# Fields without which the app can't import a record; the app tells MMS from SMS by m_type
+REQUIRED_FIELDS = {'sms': ('date', 'type'), 'mms': ('date', 'msg_box'), 'blocked_numbers': ('original_number',),
+                   'calls': ('number', 'date'), 'contacts': ()}
+
+zip_file = None  # in each worker process, the zip file being checked
+
+
+def open_zip(file_name):
+    global zip_file
+    zip_file = zipfile.ZipFile(file_name)
+
+
+def check_members(indexes):
+    """Decompress the members of zip_file at indexes (in its infolist()), returning [(name, problem)]."""
+    problems = []
+    infolist = zip_file.infolist()
+    for i in indexes:
+        info = infolist[i]
+        try:
+            size = 0
+            with zip_file.open(info) as f:  # which checks the CRC when it reaches the end
+                while block := f.read(READ_SIZE):
+                    size += len(block)
+            if size != info.file_size:
+                problems.append((info.filename, f'decompresses to {size} bytes, not {info.file_size}'))
+        except (zipfile.BadZipFile, EOFError, NotImplementedError, OSError, zlib.error) as e:
+            problems.append((info.filename, str(e) or type(e).__name__))
+    return problems
+
+
+def batches(indexes, infos):
+    """Split indexes (of members of infos, in file order) into batches of about BATCH_SIZE compressed bytes."""
+    batch, size = [], 0
+    for i in indexes:
+        batch.append(i)
+        size += infos[i].compress_size
+        if size >= BATCH_SIZE:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def numbered_lines(f):
+    """Yield (line number, line) for each non-blank line of the binary file f."""
+    number, pending = 0, []  # pieces of a line begun in earlier blocks, joined once its end is found
+    while block := f.read(READ_SIZE):
+        lines = block.split(b'\n')
+        if len(lines) == 1:
+            pending.append(block)
+            continue
+        if pending:
+            pending.append(lines[0])
+            lines[0] = b''.join(pending)
+            pending = []
+        rest = lines.pop()
+        if rest:
+            pending.append(rest)
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+    rest = b''.join(pending)
+    if rest.strip():
+        yield number + 1, rest
+
+
+def check_record(record, kind):
+    """Return the problems with a record of kind, which the app would fail to import, or import wrongly."""
+    if not isinstance(record, dict):
+        return ['not a JSON object']
+    if kind == 'messages':
+        kind = 'mms' if 'm_type' in record else 'sms'
+    problems = [f'no {field}' for field in REQUIRED_FIELDS.get(kind, ()) if field not in record]
+    if kind in ('sms', 'mms', 'calls') and 'date' in record and not str(record['date']).isdigit():
+        problems.append(f'date {record["date"]!r} is not a number')
+    if kind == 'mms':
+        addresses = record.get('__recipient_addresses', [])
+        if not isinstance(addresses, list):
+            problems.append('__recipient_addresses is not an array')
+            addresses = []
+        if '__sender_address' in record:
+            addresses = [record['__sender_address']] + addresses
+        if not all(isinstance(address, dict) and 'address' in address for address in addresses):
+            problems.append('an address has no address')
+        parts = record.get('__parts', [])
+        if not isinstance(parts, list) or not all(isinstance(part, dict) for part in parts):
+            problems.append('__parts is not an array of objects')
+        elif not all(isinstance(part['_data'], str) for part in parts if '_data' in part):
+            problems.append('a part\'s _data is not a string')
+    return problems
+
+
+class Verifier:
+    """Checks one export, collecting the problems and warnings found."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.problems = 0
+        self.warnings = 0
+        self.unit = 'record' if reader.format == 'array' else 'line'  # what records are numbered by
+
+    def report(self, where, message, warning=False):
+        if warning:
+            self.warnings += 1
+        else:
+            self.problems += 1
+        print(f'{self.reader.name}: {where}{"warning: " if warning else ""}{message}')
+
+    def records(self, references):
+        """Check each record, adding the attachments MMS parts refer to to references ({name: line number}), and
+        returning the number of records."""
+        if self.reader.format == 'array':
+            return self.check_lines(enumerate(self.reader.lines(), 1), references)
+        if self.reader.zip:
+            with self.reader.zip.open(self.reader.member) as f:
+                return self.check_lines(numbered_lines(f), references)
+        return self.check_lines(numbered_lines(self.reader.file), references)
+
+    def check_lines(self, lines, references):
+        """Check the records in lines ((number, JSON text) pairs), as records() does."""
+        reader, unit = self.reader, self.unit
+        count = 0
+        for number, line in lines:
+            count += 1
+            try:
+                record = loads(line)
+            except ValueError as e:
+                self.report(f'{unit} {number}: ', f'not valid JSON ({e})')
+                continue
+            for problem in check_record(record, reader.kind):
+                self.report(f'{unit} {number}: ', problem)
+            if reader.kind == 'messages' and isinstance(record, dict) and isinstance(record.get('__parts'), list):
+                for part in record['__parts']:
+                    if isinstance(part, dict) and isinstance(part.get('_data'), str):
+                        name = member_name(part)
+                        if name in references:
+                            self.report(f'{unit} {number}: ', f'{name} is also the data of a part on {unit} '
+                                                              f'{references[name]}, and the app only imports it once',
+                                        warning=True)
+                        else:
+                            references[name] = number
+        return count
+
+    def verify(self, jobs):
+        """Check the export, returning the number of records and of attachments."""
+        global zip_file
+        reader = self.reader
+        references = {}
+        if not reader.zip:
+            return self.records(references), 0
+        infos = reader.zip.infolist()
+        if infos[0].filename != reader.member:
+            self.report('', f'{reader.member} isn\'t the first member of the zip file, as the app expects')
+        if len(reader.zip.NameToInfo) != len(infos):
+            self.report('', 'the zip file has several members with the same name', warning=True)
+        attachments = sorted((i for i, info in enumerate(infos)
+                              if info.filename.startswith(DATA_DIRECTORY) and not info.is_dir()),
+                             key=lambda i: infos[i].header_offset)
+        # The worker processes open the file themselves, so encrypted files (which each of them would have to decrypt)
+        # are checked by this one
+        if jobs > 1 and not reader.encrypted and isinstance(reader.name, str):
+            with ProcessPoolExecutor(jobs, initializer=open_zip, initargs=(reader.name,)) as executor:
+                futures = [executor.submit(check_members, batch) for batch in batches(attachments, infos)]
+                count = self.messages(references)
+                results = [future.result() for future in futures]
+        else:
+            count = self.messages(references)
+            zip_file = reader.zip
+            results = [check_members(attachments)]
+        for problems in results:
+            for name, problem in problems:
+                self.report(f'{name}: ', problem)
+        for name, number in references.items():
+            if name not in reader.zip.NameToInfo:
+                self.report(f'{self.unit} {number}: ', f'{name} is missing')
+        for i in attachments:
+            if infos[i].filename not in references:
+                self.report(f'{infos[i].filename}: ', 'no part refers to it', warning=True)
+        return count, len(attachments)
+
+    def messages(self, references):
+        """Check the records of a zip file, including its NDJSON member's CRC."""
+        try:
+            return self.records(references)
+        except (zipfile.BadZipFile, EOFError, zlib.error) as e:
+            self.report(f'{self.reader.member}: ', str(e))
+            return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that SMS Import / Export exports are complete and importable.')
+    parser.add_argument('input_files', nargs='+', metavar='input_file',
+                        help='messages-xxx.zip, blocked_numbers-xxx.zip, calls-xxx.json or contacts-xxx.json files '
+                             '(or bare NDJSON files), possibly encrypted')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes checking attachments (default: %(default)s)')
+    args = parser.parse_args()
+
+    passphrases = {}  # asked for once, and tried on every encrypted input
+
+    def passphrase():
+        if 'passphrase' not in passphrases:
+            passphrases['passphrase'] = getpass('Enter passphrase: ')
+        return passphrases['passphrase']
+
+    failed = False
+    for input_file in args.input_files:
+        try:
+            with ExportReader(input_file, passphrase) as reader:
+                verifier = Verifier(reader)
+                count, attachments = verifier.verify(args.jobs)
+        except (ExportError, zipfile.BadZipFile) as e:
+            print(f'{input_file}: {e}')
+            failed = True
+            continue
+        failed |= verifier.problems > 0
+        print(f'{input_file}: {count} records, {attachments} attachments: {verifier.problems} problems, '
+              f'{verifier.warnings} warnings', file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -18,45 +18,125 @@
 # You should have received a copy of the GNU General Public License
 # along with SMS Import / Export.  If not, see <https://www.gnu.org/licenses/>.
 
+# By default, the messages are written to standard output as a JSON array in SMS I/E 'v1' format. With '-o
+# messages-xxx.zip', they are written in 'v2' format, one at a time, as they are parsed by a pool of worker processes.
+
 import os
 import json
 import sys
+import time
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import argparse
 
-parser = argparse.ArgumentParser(
-    description='convert SMS messages in Nokia VMG format to SMS Import / Export JSON format')
-parser.add_argument('directory', help='directory containing (only) VMG files')
-parser.add_argument('-d', '--debug', action='store_true', help='debugging output')
-args = parser.parse_args()
+from sms_ie import ExportWriter, dumps
+
+BATCH_SIZE = 256  # files parsed by a worker process at a time
+PROGRESS_INTERVAL = 1  # seconds between progress reports
 
-messages = []
-for file in os.listdir(args.directory):
-    if args.debug:
-        sys.stderr.write('Processing ' + file + '\n')
+
+def parse_vmg(file_name, debug=False):
+    if debug:
+        sys.stderr.write('Processing ' + file_name + '\n')
     FILE, BODY = 0, 1
     mode = FILE
     sms = {}
-    for line in open(os.path.join(args.directory, file), encoding='utf-16'):
-        if mode == BODY:
-            if line.strip() == 'END:VBODY':
-                mode = FILE
-            elif line[:5] != 'Date:':
-                sms['body'] += line.strip()
-        else:
-            name, value = line.strip().split(':')
-            if name == 'BEGIN':
-                if value == 'VBODY':
-                    mode = BODY
-                    sms['body'] = ''
-            elif name == 'X-IRMC-STATUS':
-                sms['read'] = '1' if value == 'READ' else '0'
-            elif name == 'X-IRMC-BOX':
-                sms['type'] = '2' if value == 'SENT' else '1'
-            # I'm not sure if we should set 'date', 'date_sent', or both here
-            elif name == 'X-NOK-DT':
-                sms['date'] = str(int(datetime.fromisoformat(value).timestamp() * 1000))
-            elif name == 'TEL':
-                sms['address'] = value
-    messages.append(sms)
-print(json.dumps(messages, indent=2))
+    with open(file_name, encoding='utf-16') as vmg:
+        for line in vmg:
+            if mode == BODY:
+                if line.strip() == 'END:VBODY':
+                    mode = FILE
+                elif line[:5] != 'Date:':
+                    sms['body'] += line.strip()
+            else:
+                name, value = line.strip().split(':')
+                if name == 'BEGIN':
+                    if value == 'VBODY':
+                        mode = BODY
+                        sms['body'] = ''
+                elif name == 'X-IRMC-STATUS':
+                    sms['read'] = '1' if value == 'READ' else '0'
+                elif name == 'X-IRMC-BOX':
+                    sms['type'] = '2' if value == 'SENT' else '1'
+                # I'm not sure if we should set 'date', 'date_sent', or both here
+                elif name == 'X-NOK-DT':
+                    sms['date'] = str(int(datetime.fromisoformat(value).timestamp() * 1000))
+                elif name == 'TEL':
+                    sms['address'] = value
+    return sms
+
+
+def parse_batch(file_names, debug):
+    return [parse_vmg(file_name, debug) for file_name in file_names]
+
+
+def parse_all(file_names, jobs, debug):
+    """Parse the VMG files with up to jobs worker processes, yielding the messages in order, and reporting progress on
+    standard error."""
+    start = last_report = time.monotonic()
+    done = 0
+
+    def report(end=''):
+        elapsed = time.monotonic() - start
+        sys.stderr.write(f'\r{done}/{len(file_names)} files, {done / elapsed if elapsed else 0:.0f} files/s{end}')
+
+    def collect(future):
+        nonlocal done, last_report
+        messages = future.result()
+        done += len(messages)
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            report()
+            last_report = time.monotonic()
+        return messages
+
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()  # bounded, so that parsed messages don't accumulate faster than they are written
+        for i in range(0, len(file_names), BATCH_SIZE):
+            pending.append(executor.submit(parse_batch, file_names[i:i + BATCH_SIZE], debug))
+            if len(pending) == 2 * jobs:
+                yield from collect(pending.popleft())
+        while pending:
+            yield from collect(pending.popleft())
+    report('\n')
+
+
+def write_zip(messages, output_file, sort_by_date):
+    """Write messages to output_file's messages.ndjson. To sort them by date without holding them all in memory, they
+    are first written to a temporary file, and only their dates and positions in it are sorted."""
+    with ExportWriter(output_file) as messages_zip:
+        if not sort_by_date:
+            for sms in messages:
+                messages_zip.write(sms)
+            return
+        positions = []  # (date, offset, length)
+        with tempfile.TemporaryFile() as spool:
+            for sms in messages:
+                line = dumps(sms)
+                positions.append((int(sms.get('date', 0)), spool.tell(), len(line)))
+                spool.write(line)
+            positions.sort()
+            for date, offset, length in positions:
+                spool.seek(offset)
+                messages_zip.write_line(spool.read(length))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='convert SMS messages in Nokia VMG format to SMS Import / Export JSON format')
+    parser.add_argument('directory', help='directory containing (only) VMG files')
+    parser.add_argument('-d', '--debug', action='store_true', help='debugging output')
+    parser.add_argument('-o', '--output', help="write the messages to this zip file in 'v2' format")
+    parser.add_argument('-s', '--sort', choices=('name', 'date'), default='name',
+                        help="with --output, order the messages by VMG file name (the default) or by date")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.output:
+        file_names = sorted(os.path.join(args.directory, file) for file in os.listdir(args.directory))
+        write_zip(parse_all(file_names, args.jobs, args.debug), args.output, args.sort == 'date')
+    else:
+        file_names = [os.path.join(args.directory, file) for file in os.listdir(args.directory)]
+        print(json.dumps(list(parse_all(file_names, args.jobs, args.debug)), indent=2))